@@ -6,6 +6,7 @@ from PySide6.QtWidgets import QLabel
 
 class QClickableLabel(QLabel):
     clicked = QtCore.Signal(QPointF)
+    released = QtCore.Signal(QPointF)
 
     def __init__(self, parent=None):
         QLabel.__init__(self, parent=parent)
@@ -17,3 +18,6 @@ class QClickableLabel(QLabel):
     def mouseMoveEvent(self, ev: QMouseEvent) -> None:
         if ev.buttons():
             self.clicked.emit(ev.position())
+
+    def mouseReleaseEvent(self, ev: QMouseEvent) -> None:
+        self.released.emit(ev.position())
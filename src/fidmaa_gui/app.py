@@ -1,14 +1,13 @@
-import math
 import os
 import sys
 import traceback
 from pathlib import Path
-from textwrap import dedent
 from typing import Optional
 
+import numpy
 import PySide6
 from fidmaa_simple_viewer.core import FIDMAA_to_pyvista_surface
-from PIL import Image, ImageFile, ImageFilter
+from PIL import ImageFile
 from portrait_analyser.exceptions import (
     ExifValidationFailed,
     MultipleFacesDetected,
@@ -16,20 +15,54 @@ from portrait_analyser.exceptions import (
     NoFacesDetected,
     UnknownExtension,
 )
-from portrait_analyser.face import get_face_parameters
-from portrait_analyser.ios import IOSPortrait, load_image
-from PySide6 import QtGui
-from PySide6.QtCore import QFile, QObject, QPoint, QSettings, Qt
+from portrait_analyser.ios import IOSPortrait
+from PySide6 import QtCore, QtGui
+from PySide6.QtCore import (
+    QEvent,
+    QFile,
+    QObject,
+    QPoint,
+    QPointF,
+    QRectF,
+    QSettings,
+    Qt,
+    QThreadPool,
+)
 from PySide6.QtGui import QColor
 from PySide6.QtUiTools import QUiLoader
-from PySide6.QtWidgets import QApplication, QFileDialog, QMessageBox, QWidget
+from PySide6.QtWidgets import (
+    QApplication,
+    QFileDialog,
+    QLabel,
+    QMessageBox,
+    QWidget,
+)
 
-from . import const, errors
+from . import (
+    calibration,
+    const,
+    errors,
+    export,
+    measurements,
+    mesh,
+    reports,
+)
 from .calculations import findPoint
+from .coordinates import DEPTHMAP_SIZE, CoordinateSystem
+from .display import DisplayBuffer, channels, ensure_buffer, sharpen, zoom_into
+from .export import find_portraits
+from .loading import PortraitLoader, load_depth_preview
+from .measurements import RubberBand
+from .overlays import OverlayCache
 from .QClickableLabel import QClickableLabel
+from .regions import Polygon, RegionEngine
+from .thumbnails import ThumbnailModel
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+# Sent to widgets since Qt 6.6; older versions only report screen changes:
+DEVICE_PIXEL_RATIO_CHANGE = getattr(QEvent.Type, "DevicePixelRatioChange", None)
+
 tr = QObject.tr
 
 
@@ -45,53 +78,6 @@ class MyQUiLoader(QUiLoader):
         return super(MyQUiLoader, self).createWidget(className, parent, name)
 
 
-def CV2_to_QImage(cv2_image):
-    return QtGui.QImage(
-        cv2_image.data,
-        cv2_image.shape[1],
-        cv2_image.shape[0],
-        QtGui.QImage.Format_RGB888,
-    ).rgbSwapped()
-
-
-def interpolate_pixels_along_line(x1, y1, z1, x2, y2, z2):
-    dist_x = x2 - x1
-    dist_y = y2 - y1
-    dist_z = z2 - z1
-
-    # line_len = math.sqrt(dist_x**2 + dist_y**2 + dist_z**2)
-
-    abs_dist_x = abs(dist_x)
-    abs_dist_y = abs(dist_y)
-    abs_dist_z = abs(dist_z)
-
-    if abs_dist_x >= abs_dist_y and abs_dist_x >= abs_dist_z:
-        no_steps = abs_dist_x
-    elif abs_dist_y >= abs_dist_x and abs_dist_y >= abs_dist_z:
-        no_steps = abs_dist_y
-    elif abs_dist_z >= abs_dist_x and abs_dist_z >= abs_dist_y:
-        no_steps = abs_dist_z
-    else:
-        raise NotImplementedError(dist_x, dist_y, dist_z)
-
-    if no_steps == 0:
-        return
-
-    delta_x = dist_x / no_steps
-    delta_y = dist_y / no_steps
-    delta_z = dist_z / no_steps
-
-    for a in range(no_steps + 1):
-        yield (x1, y1, z1)
-        x1 += delta_x
-        y1 += delta_y
-        z1 += delta_z
-
-
-def clamp(n, minn, maxn):
-    return max(min(maxn - 1, n), minn)
-
-
 class UILoaderMixin:
     def load_ui(self):
         loader = MyQUiLoader(self)
@@ -131,10 +117,11 @@ class ZoomWindow(UILoaderMixin, QWidget):
         self.ui.reconstructionLabel.setPixmap(canvas)
 
     def paintZoomedImage(self, zoomed):
+        """:param zoomed: `DisplayBuffer` with the zoomed photo"""
         canvas = self.ui.zoomedImageLabel.pixmap()
         painter = QtGui.QPainter(canvas)
         canvas.fill(Qt.green)
-        painter.drawImage(0, 0, zoomed.toqimage())
+        painter.drawImage(0, 0, zoomed.qimage)
 
         painter.setPen(QColor(255, 0, 0, 255))
 
@@ -151,10 +138,11 @@ class ZoomWindow(UILoaderMixin, QWidget):
         self.ui.zoomedImageLabel.setPixmap(canvas)
 
     def paintZoomedDepthmap(self, depthmap):
+        """:param depthmap: `DisplayBuffer` with the zoomed depth map"""
         canvas = self.ui.zoomedDepthMapLabel.pixmap()
         painter = QtGui.QPainter(canvas)
         canvas.fill(Qt.yellow)
-        painter.drawImage(0, 0, depthmap.toqimage())
+        painter.drawImage(0, 0, depthmap.qimage)
 
         painter.setPen(QColor(255, 0, 0, 255))
 
@@ -170,7 +158,7 @@ class ZoomWindow(UILoaderMixin, QWidget):
         font = painter.font()
         font.setPixelSize(32)
         painter.setFont(font)
-        value = depthmap.getpixel((240, 160))[0]
+        value = int(depthmap.array[160, 240])
         if value < 100:
             painter.setPen(QColor(255, 0, 0, 255))
         else:
@@ -193,107 +181,267 @@ class ZoomWindow(UILoaderMixin, QWidget):
             v = values[int(a * len(values) / 480.0)]
             # v = 256 * ((v - values_min) / (values_max))
             painter.drawLine(
-                QPoint(
+                QPointF(
                     a,
                     256,
                 ),
-                QPoint(a, 256 - v),
+                QPointF(a, 256 - v),
             )
 
         painter.end()
         self.ui.reconstructionLabel.setPixmap(canvas)
 
 
+class ThumbnailBrowser(UILoaderMixin, QWidget):
+    uifile_name = "thumbnail_browser.ui"
+
+    fileSelected = QtCore.Signal(str)
+
+    def __init__(self, directory, parent=None):
+        super().__init__(parent)
+        self.model = None
+        # Shared by the models of all the directories shown:
+        self.pool = QThreadPool(self)
+        self.load_ui()
+        self.setDirectory(directory)
+
+    def setDirectory(self, directory):
+        previous = self.model
+        if previous is not None:
+            previous.shutdown()
+
+        self.model = ThumbnailModel(find_portraits(directory), self, pool=self.pool)
+        self.ui.thumbnailView.setModel(self.model)
+        if previous is not None:
+            previous.deleteLater()
+        self.ui.directoryLabel.setText(directory)
+        self.setWindowTitle(f"FIDMAA - {directory}")
+
+    def thumbnailDoubleClicked(self, index):
+        self.fileSelected.emit(index.data(Qt.UserRole))
+
+    def cancelHiddenThumbnails(self, *args, **kw):
+        """Do not decode thumbnails of rows scrolled out of view"""
+        view = self.ui.thumbnailView
+        rect = view.viewport().rect()
+        first = view.indexAt(rect.topLeft())
+        last = view.indexAt(rect.bottomRight())
+        first = first.row() if first.isValid() else 0
+        last = last.row() if last.isValid() else self.model.rowCount() - 1
+        # Keep a page of margin in both directions:
+        page = last - first + 1
+        self.model.cancelOutside(first - page, last + page)
+
+    def closeEvent(self, event):
+        self.model.shutdown()
+        super().closeEvent(event)
+
+    def connect_ui(self):
+        self.ui.thumbnailView.doubleClicked.connect(self.thumbnailDoubleClicked)
+        self.ui.thumbnailView.verticalScrollBar().valueChanged.connect(
+            self.cancelHiddenThumbnails
+        )
+
+
 class MainWindow(UILoaderMixin, QWidget):
     uifile_name = "form.ui"
 
     def __init__(self, parent=None, zoomWindow=None):
         super().__init__(parent)
+        self.coords = None
         self.load_ui()
 
         self.filename = None
         self.face = None
 
         self.smallImage = None
+        self.image = None
+        self.imageArray = None
+        self.previewArray = None
+        self.depthArray = None
+        self.zoomedImage = None
+        self.zoomedDepthmap = None
+        self.sharpenScratch = None
+        self.overlays = None
+        self.regionEngine = None
+        self.region = Polygon()
+        self.rubberBand = None
+        self.calibration = calibration.DEFAULT
         self.portrait: IOSPortrait = None
+        self.portraitLoader = None
         self.depthmap = None
         self.teethmap = None
 
         self.float_max_value = self.float_min_value = None
 
         self.zoomWindow = zoomWindow
+        self.thumbnailBrowser = None
 
         self.last_click_x = None
         self.last_click_y = None
+        # Whether the last click point and the point being drawn now come
+        # from clicks of the user; only such pairs are recorded:
+        self.last_click_by_user = False
+        self.user_click = False
         self.last_angle = None
         self.last_depth = None
         self.face = None
 
+        self.measurements = []
+
+        self.reportGeneration = 0
+        self.loadGeneration = 0
+        self.reportWorker = reports.ReportWorker(self)
+        self.reportWorker.finished.connect(self.paintReport)
+        self.reportWorker.failed.connect(self.reportFailed)
+
         self.redrawImage()
         self.redrawZoom()
 
-    def get_depthmap_distance(self, value):
-        """Returns a distance from a given depthMap value in centimeters
-        using EXIF data from TrueDepth[tm] camera
-
-        :returns: distance in centimeters
-        """
-        if self.float_min_value is None or self.float_max_value is None:
-            return value
-
-        return (
-            100
-            * 1.0
-            / (
-                self.float_max_value * value / 255
-                + self.float_min_value * (1 - value / 255)
-            )
+    def coordinateSystem(self, photo_size, depth_size=DEPTHMAP_SIZE):
+        """Coordinate system of a portrait, as painted in this window"""
+        label = self.ui.imageLabel
+        return CoordinateSystem(
+            photo_size,
+            depth_size,
+            (label.width(), label.height()),
+            self.devicePixelRatioF(),
         )
 
+    def updateDisplay(self, *args, **kw):
+        """Rebuild the display part of the coordinate system after the window
+        moved to a screen with another scaling or the image was resized"""
+        if self.coords is None:
+            # Not set up yet
+            return
+
+        label = self.ui.imageLabel
+        coords = self.coords.with_display(
+            (label.width(), label.height()), self.devicePixelRatioF()
+        )
+        if (coords.display_size, coords.device_pixel_ratio) == (
+            self.coords.display_size,
+            self.coords.device_pixel_ratio,
+        ):
+            return
+        self.coords = coords
+
+        # Keep what is painted until the next redraw:
+        previous = label.pixmap()
+        canvas = self.overlayCanvas()
+        painter = QtGui.QPainter(canvas)
+        painter.drawPixmap(
+            QRectF(0, 0, *coords.display_size), previous, QRectF(previous.rect())
+        )
+        painter.end()
+        label.setPixmap(canvas)
+
+        for overlay in self.overlayLabels:
+            overlay.setGeometry(0, 0, *coords.display_size)
+
+        source = self.displaySource()
+        if source is not None:
+            self.smallImage = DisplayBuffer.from_image(source, coords.device_size)
+        if self.overlays is not None:
+            self.overlays = OverlayCache(
+                self.depthArray,
+                self.overlays.depth_cm,
+                coords.device_size,
+                coords.device_pixel_ratio,
+            )
+            self.updateOverlays()
+        self.updateRegion()
+        self.rubberBandLabel.hide()
+
+    def displaySource(self):
+        """The best image available so far: the photo, its embedded
+        thumbnail or the depth map"""
+        for source in self.imageArray, self.previewArray, self.depthArray:
+            if source is not None:
+                return source
+
+    def event(self, event):
+        if event.type() == DEVICE_PIXEL_RATIO_CHANGE:
+            self.updateDisplay()
+        return super().event(event)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.screenChangeConnected:
+            self.windowHandle().screenChanged.connect(self.updateDisplay)
+            self.screenChangeConnected = True
+        self.updateDisplay()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.updateDisplay()
+
+    def overlayCanvas(self):
+        """Transparent pixmap for an overlay label, sharp on HiDPI screens"""
+        canvas = QtGui.QPixmap(*self.coords.device_size)
+        canvas.setDevicePixelRatio(self.coords.device_pixel_ratio)
+        canvas.fill(Qt.transparent)
+        return canvas
+
+    def chartCanvas(self):
+        """Pixmap of the depth chart: a row for every row of the depth map,
+        a column for every raw depth value"""
+        canvas = self.ui.chartLabel.pixmap()
+        if canvas.height() != self.coords.depth_height:
+            canvas = QtGui.QPixmap(255, self.coords.depth_height)
+        return canvas
+
+    def depthPainter(self, canvas):
+        """Painter taking depth map coordinates"""
+        painter = QtGui.QPainter(canvas)
+        painter.scale(*self.coords.display_scale)
+        return painter
+
     def redrawZoom(self, *args, **kw):
         if args:
             event = args[0]
-            mouse_x = event.x()
-            mouse_y = event.y()
+            mouse_x, mouse_y = self.coords.display_to_depth_pixel(event.x(), event.y())
+            self.updateRubberBand(mouse_x, mouse_y)
         else:
             mouse_x = mouse_y = 0
 
+        if self.region.move(mouse_x, mouse_y):
+            self.updateRegion()
+
         if self.zoomWindow:
-            if self.smallImage:
-                big_image_x = mouse_x * self.image.size[0] / 480
-                big_image_y = mouse_y * self.image.size[1] / 640
-                zoomed = self.image.crop(
-                    (
-                        big_image_x - 120,
-                        big_image_y - 80,
-                        big_image_x + 120,
-                        big_image_y + 80,
-                    )
-                ).resize((480, 320))
+            if self.imageArray is not None:
+                big_image_x, big_image_y = self.coords.depth_to_photo(mouse_x, mouse_y)
 
-                self.zoomWindow.paintZoomedImage(
-                    zoomed,
+                self.zoomedImage = ensure_buffer(
+                    self.zoomedImage, 480, 320, channels(self.imageArray)
+                )
+                zoom_into(
+                    self.imageArray,
+                    big_image_x,
+                    big_image_y,
+                    240,
+                    160,
+                    self.zoomedImage,
                 )
+                self.zoomWindow.paintZoomedImage(self.zoomedImage)
 
-            if self.depthmap:
-                zoomed = (
-                    self.depthmap.crop(
-                        (mouse_x - 144, mouse_y - 96, mouse_x + 144, mouse_y + 96)
-                    )
-                    .resize((480, 320), Image.HAMMING)
-                    .filter(ImageFilter.SHARPEN)
-                    .filter(ImageFilter.SHARPEN)
-                    .filter(ImageFilter.SHARPEN)
+            if self.depthArray is not None:
+                self.zoomedDepthmap = ensure_buffer(self.zoomedDepthmap, 480, 320, 1)
+                zoom_into(
+                    self.depthArray, mouse_x, mouse_y, 288, 192, self.zoomedDepthmap
                 )
-                self.zoomWindow.paintZoomedDepthmap(zoomed)
+                self.sharpenScratch = ensure_buffer(self.sharpenScratch, 480, 320, 1)
+                sharpen(self.zoomedDepthmap, times=3, scratch=self.sharpenScratch)
+                self.zoomWindow.paintZoomedDepthmap(self.zoomedDepthmap)
 
     def redrawImage(self, *args, **kw):
         mouse_x = x = self.ui.xValue.value()
         y = mouse_y = self.ui.yValue.value()
         angle = self.ui.angleValue.value()
+        user_click = self.user_click
+        self.user_click = False
 
-        mouse_x = clamp(mouse_x, 0, 480)
-        mouse_y = clamp(mouse_y, 0, 640)
+        mouse_x, mouse_y = self.coords.clamp(mouse_x, mouse_y)
 
         if self.last_click_x is not None:
             if (
@@ -306,12 +454,17 @@ class MainWindow(UILoaderMixin, QWidget):
         self.last_angle = angle
 
         canvas = self.ui.imageLabel.pixmap()
-        painter = QtGui.QPainter(canvas)
+        if canvas.devicePixelRatio() != self.coords.device_pixel_ratio:
+            # The window moved to a screen with another scaling
+            canvas = self.overlayCanvas()
+        canvas.fill(Qt.white)
+        painter = self.depthPainter(canvas)
         painter.setPen(QColor(0, 0, 255, 127))
         painter.pen().setDashOffset(2)
-        canvas.fill(Qt.white)
         if self.smallImage:
-            painter.drawImage(0, 0, self.smallImage.toqimage())
+            painter.drawImage(
+                QRectF(0, 0, *self.coords.depth_size), self.smallImage.qimage
+            )
 
         # if self.teethmap:
         #     ni = self.teethmap.resize((480, 640)).filter(
@@ -322,26 +475,31 @@ class MainWindow(UILoaderMixin, QWidget):
 
         if self.portrait:
             if self.portrait.teeth_bbox:
-                tx, ty, twi, the = self.portrait.teeth_bbox_translated(480, 640)
+                tx, ty, twi, the = self.portrait.teeth_bbox_translated(
+                    *self.coords.depth_size
+                )
                 painter.setPen(QColor(255, 255, 0, 127))
                 painter.drawRect(tx, ty, twi, the)
 
         if self.face:
             painter.setPen(QColor(0, 0, 255, 127))
-            face_rect = self.face.translate_coordinates(480, 640)
+            face_rect = self.coords.rect_to_depth(self.face)
             painter.drawRect(*face_rect)
 
             for eye in self.face.eyes:
                 painter.setPen(QColor(0, 255, 0, 127))
-                rect = eye.translate_coordinates(480, 640)
+                rect = self.coords.rect_to_depth(eye)
                 painter.drawRect(*rect)
 
         painter.setPen(QColor(0, 0, 255, 127))
 
         # Calculate 2 points at the edge of the image, using the angle.
 
-        p1 = findPoint(x, y, direction=-1, angle=angle)
-        p2 = findPoint(x, y, direction=1, angle=angle)
+        width, height = self.coords.depth_size
+        p1 = findPoint(
+            x, y, direction=-1, maxWidth=width, maxHeight=height, angle=angle
+        )
+        p2 = findPoint(x, y, direction=1, maxWidth=width, maxHeight=height, angle=angle)
         painter.drawLine(p1, p2)
 
         if self.last_click_x is not None:
@@ -350,307 +508,240 @@ class MainWindow(UILoaderMixin, QWidget):
                 QPoint(mouse_x, mouse_y), QPoint(self.last_click_x, self.last_click_y)
             )
 
-        if self.portrait and self.portrait.teeth_bbox:
-            smx, smy, smwi, smhe = self.portrait.teeth_bbox_translated(480, 640)
-            smy += 3
-            smhe -= 6
-
-            z1 = self.get_depthmap_value(smx + smwi / 2, smy)
-            z2 = self.get_depthmap_value(smx + smwi / 2, smy + smhe)
-
-            distance_z1 = self.get_depthmap_distance(z1)
-            distance_z2 = self.get_depthmap_distance(z2)
-
-            distance_x1, distance_y1 = self.translate_click_to_mm(
-                distance_z1, smx + smwi / 2, smy
-            )
-
-            distance_x2, distance_y2 = self.translate_click_to_mm(
-                distance_z2,
-                smx + smwi / 2,
-                smy + smhe,
-            )
-
-            teethbox_args = (
-                distance_x1,
-                distance_y1,
-                distance_z1,
-                distance_x2,
-                distance_y2,
-                distance_z2,
-            )
-            # print("Teethbox", args)
+        teeth = measurements.incisor_line(self.portrait, self.coords)
+        if teeth is not None:
+            teeth_x, teeth_y1, teeth_y2 = teeth
             painter.setPen(QColor(255, 255, 0, 255))
-            painter.drawLine(smx + smwi / 2, smy, smx + smwi / 2, smhe + smy)
+            painter.drawLine(QPointF(teeth_x, teeth_y1), QPointF(teeth_x, teeth_y2))
 
         painter.end()
         self.ui.imageLabel.setPixmap(canvas)
 
         # Now the right image -- the depths:
 
-        canvas = self.ui.chartLabel.pixmap()
-        painter = QtGui.QPainter(canvas)
-        canvas.fill(Qt.red)
-
-        if self.depthmap:
-            point_beg = p2
-            point_end = p1
-
-            if p1.y() < p2.y():
-                point_beg = p1
-                point_end = p2
-
-            for pixels in interpolate_pixels_along_line(
-                point_beg.x(), 0, 0, point_end.x(), 639, 0
-            ):
-                painter.drawLine(
-                    0,
-                    pixels[1],
-                    self.get_depthmap_value(pixels[0], pixels[1]),
-                    pixels[1],
-                )
-
-            if self.last_click_x is not None:
-                painter.setPen(QColor(0, 255, 0, 127))
-
-                z1 = self.get_depthmap_value(mouse_x, mouse_y)
-                z2 = self.get_depthmap_value(self.last_click_x, self.last_click_y)
-
-                painter.drawLine(
-                    QPoint(z1, mouse_y),
-                    QPoint(z2, self.last_click_y),
-                )
-
-                values = []
-                for pixels in interpolate_pixels_along_line(
-                    mouse_x, mouse_y, 0, self.last_click_x, self.last_click_y, 0
-                ):
-                    values.append(self.get_depthmap_value(pixels[0], pixels[1]))
-                self.zoomWindow.paintReconstruction(values)
-
-            painter.end()
+        if not self.depthmap:
+            canvas = self.chartCanvas()
+            canvas.fill(Qt.red)
             self.ui.chartLabel.setPixmap(canvas)
+            return
 
-            mouse_x = clamp(mouse_x, 0, 480)
-            mouse_y = clamp(mouse_y, 0, 640)
-
-            if self.last_click_x is None:
-                line_len = 0
-            else:
-                line_x = abs(self.last_click_x - mouse_x)
-                line_y = abs(self.last_click_y - mouse_y)
-                line_len = self.calculate_line_length(line_x, line_y)
-
-            surface_length_3d = vector_len_voxels = vector_length_3d = 0
-            if (
-                self.last_click_x != mouse_x or self.last_click_y != mouse_y
-            ) and self.last_click_x is not None:
-                z1 = self.get_depthmap_value(mouse_x, mouse_y)
-                z2 = self.get_depthmap_value(self.last_click_x, self.last_click_y)
-
-                vector_len_voxels = self.vector_length_simple(
-                    mouse_x, mouse_y, z1, self.last_click_x, self.last_click_y, z2
-                )
-
-                distance_z1 = self.get_depthmap_distance(z1)
-                distance_z2 = self.get_depthmap_distance(z2)
+        point_beg = p2
+        point_end = p1
 
-                distance_x1, distance_y1 = self.translate_click_to_mm(
-                    distance_z1, mouse_x, mouse_y
-                )
-                distance_x2, distance_y2 = self.translate_click_to_mm(
-                    distance_z2, self.last_click_x, self.last_click_y
-                )
-                args = (
-                    distance_x1,
-                    distance_y1,
-                    distance_z1,
-                    distance_x2,
-                    distance_y2,
-                    distance_z2,
-                )
-                vector_length_3d = self.vector_length_simple(*args)
+        if p1.y() < p2.y():
+            point_beg = p1
+            point_end = p2
 
-                surface_length_3d = self.vector_length_surface(
-                    mouse_x, mouse_y, self.last_click_x, self.last_click_y
-                )
+        previous_click = None
+        if self.last_click_x is not None:
+            previous_click = (self.last_click_x, self.last_click_y)
+
+        # Measurements are computed in the background, see paintReport:
+        self.reportGeneration += 1
+        self.reportWorker.submit(
+            reports.Snapshot(
+                generation=self.reportGeneration,
+                load_generation=self.loadGeneration,
+                depth_raw=self.depthArray,
+                depth_cm=self.overlays.depth_cm,
+                float_range=(self.float_min_value, self.float_max_value),
+                coords=self.coords,
+                calibration=self.calibration,
+                density=const.PROFILE_SAMPLES_PER_PIXEL,
+                interpolation=const.PROFILE_INTERPOLATION,
+                midline=(point_beg.x(), 0, point_end.x(), height - 1),
+                click=(mouse_x, mouse_y),
+                previous_click=previous_click,
+                previous_depth=self.last_depth,
+                record_pair=user_click and self.last_click_by_user,
+                portrait=self.portrait,
+            )
+        )
 
-            self.last_click_x = mouse_x
-            self.last_click_y = mouse_y
+        self.last_click_x = mouse_x
+        self.last_click_y = mouse_y
+        self.last_click_by_user = user_click
+        self.last_depth = int(self.depthArray[mouse_y, mouse_x])
 
-            closeness = self.depthmap.getpixel((mouse_x, mouse_y))[0]
+    def paintReport(self, report):
+        if report.load_generation != self.loadGeneration:
+            # Computed for a portrait which is not open anymore
+            return
 
-            depth_mm = self.get_depthmap_distance(closeness)
+        if report.record is not None:
+            if report.coords.photo_size != self.coords.photo_size:
+                # Clicked before the photo was decoded, see _portraitLoaded
+                report.record = self.remeasure(report.record)
+            self.measurements.append(report.record)
 
-            closeness_delta = 0
-            closeness_delta_mm = 0.0
+        if report.generation != self.reportGeneration:
+            # Superseded by a newer click or angle
+            return
 
-            if self.last_depth:
-                closeness_delta = self.last_depth - closeness
-                closeness_delta_mm = (
-                    self.get_depthmap_distance(self.last_depth) - depth_mm
-                )
+        canvas = self.chartCanvas()
+        painter = QtGui.QPainter(canvas)
+        canvas.fill(Qt.red)
 
-            self.last_depth = closeness
+        for y, value in zip(*report.chart_profile):
+            painter.drawLine(QPointF(0, y), QPointF(value, y))
 
-            self.ui.dataOutputEdit.clear()
-            txt = dedent(
-                f"""
-            Depth map coords:
-            {mouse_x, mouse_y}
+        if report.chart_click_line is not None:
+            z1, y1, z2, y2 = report.chart_click_line
+            painter.setPen(QColor(0, 255, 0, 127))
+            painter.drawLine(QPoint(z1, y1), QPoint(z2, y2))
 
-            Depth map raw data:
-            {closeness} (Δ: {closeness_delta})
+        painter.end()
+        self.ui.chartLabel.setPixmap(canvas)
 
-            Depth map distance:
-            {depth_mm:.2f} cm (Δ: {closeness_delta_mm:.1f} cm)
+        if report.reconstruction is not None:
+            self.zoomWindow.paintReconstruction(report.reconstruction)
 
-            Line length (2D, on flat picture):
-            {line_len:.2f} pixels
+        self.ui.dataOutputEdit.clear()
+        self.ui.dataOutputEdit.appendPlainText(report.text)
 
-            Vector length (3D) simple - on raw data:
-            {vector_len_voxels:.2f} voxels
+    def reportFailed(self, snapshot, exception):
+        if snapshot.generation != self.reportGeneration:
+            return
+        tb_text = "".join(traceback.format_exception(exception))
+        self.critical_error(f"Exception: {tb_text}")
 
-            Vector length (3D) with depth:
-            {vector_length_3d / 10.0:.2f} cm
+    def _loadImage(self, fileName):
+        self.filename = fileName
 
-            Vector length (3D) on surface:
-            {(surface_length_3d / 10.0):.2f} cm"""
+        try:
+            preview = load_depth_preview(self.filename, with_thumbnail=True)
+        except ExifValidationFailed as e:
+            QMessageBox.critical(
+                self,
+                tr("FIDMAA notification"),
+                errors.NO_FRONT_CAMERA_NOTIFICATION.format(exif_camera_description=e),
             )
+            return
 
-            if self.portrait.teeth_bbox:
-                txt += "\n\nAutomatic incisor distance:\n"
-                txt += "%.2f cm" % (self.vector_length_simple(*teethbox_args) / 10.0)
+        except NoDepthMapFound:
+            self.critical_error(errors.NO_DEPTH_DATA_ERROR)
+            return
 
-            if (
-                closeness_delta_mm is not None
-                and vector_length_3d is not None
-                and vector_length_3d > 0.0
-            ):
-                try:
-                    txt += "\n\nAngle for last 2 clicks:\n%.2f°" % math.degrees(
-                        math.acos(abs(closeness_delta_mm / (vector_length_3d / 10.0)))
-                    )
-                except ValueError:
-                    pass
+        except UnknownExtension as e:
+            self.critical_error(QObject.tr("Unknown file extension (%s)" % e))
+            return
+
+        # Depth data is enough to take measurements; paint the embedded
+        # thumbnail (or the depth map) and decode the full-resolution photo
+        # in the background:
 
-            self.ui.dataOutputEdit.appendPlainText(txt.strip())
+        self.portrait = None
+        self.image = None
+        self.imageArray = None
+        self.previewArray = None
+        if preview.thumbnail is not None:
+            self.previewArray = numpy.asarray(preview.thumbnail)
+        self.teethmap = None
+        self.face = None
+        self.depthmap = preview.depthmap
+        self.float_min_value = preview.floatValueMin
+        self.float_max_value = preview.floatValueMax
 
-    def get_depthmap_value(self, x, y):
-        return self.depthmap.getpixel((x, y))[0]
+        # self.depthmap = self.depthmap.filter(ImageFilter.GaussianBlur)
 
-    def translate_click_to_mm(
-        self, distance_cm, x, y, SMALL_WIDTH=480, SMALL_HEIGHT=640
-    ):
-        return (
-            self.how_many_mm_per_pixels_at_distance_on_big_image(
-                distance_cm, x * self.image.size[0] / SMALL_WIDTH
-            ),
-            self.how_many_mm_per_pixels_at_distance_on_big_image(
-                distance_cm, y * self.image.size[1] / SMALL_HEIGHT
-            ),
+        self.loadGeneration += 1
+        # Shared with background workers, never modified in place:
+        self.depthArray = numpy.ascontiguousarray(
+            measurements.depthmap_to_array(self.depthmap)
         )
-
-    def vector_length_surface(
-        self,
-        mouse_x,
-        mouse_y,
-        last_click_x,
-        last_click_y,
-    ):
-        """Calculate length iterating over the surface of 3D data"""
-
-        z1 = self.get_depthmap_value(mouse_x, mouse_y)
-        z2 = self.get_depthmap_value(last_click_x, last_click_y)
-        pixels = list(
-            interpolate_pixels_along_line(
-                mouse_x, mouse_y, z1, last_click_x, last_click_y, z2
-            )
+        self.depthArray.flags.writeable = False
+        # Built once per portrait, shared by all the measurements and painting:
+        self.coords = self.coordinateSystem(
+            preview.photo_size, (self.depthArray.shape[1], self.depthArray.shape[0])
         )
-        s = []
-
-        for (x1, y1, z1), (x2, y2, z2) in zip(pixels, pixels[1:]):
-            z1 = self.get_depthmap_distance(self.get_depthmap_value(x1, y1))
-            x1, y1 = self.translate_click_to_mm(z1, x1, y1)
-
-            z2 = self.get_depthmap_distance(self.get_depthmap_value(x2, y2))
-            x2, y2 = self.translate_click_to_mm(z2, x2, y2)
-
-            line_len_3d = self.vector_length_simple(x1, y1, z1, x2, y2, z2)
-            s.append(line_len_3d)
-        return sum(s)
-
-    def vector_length_simple(self, x1, y1, z1, x2, y2, z2):
-        """Simple mathematical lenght of the vector"""
-        return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2)
-
-    def calculate_line_length(self, dist_x, dist_y):
-        line_len = math.sqrt(abs(dist_x * dist_x) + abs(dist_y * dist_y))
-        return line_len
-
-    def how_many_pixels_per_mm_at_distance_on_big_image(self, distance, mm):
-        """Returns how many pixels take up a 1 milimiter at a given distance (cm) from camera.
-
-        Constants taken from own calibration data and a curve fitted by MyCurveFit.com,
-        I strongly recommend their service, it is very easy to use and affordable.
-
-        :param distance: The distance in centimeters from the camera
-        :param no_pixels: line length in pixels, must be in original image size (2300x3000)
-        """
-        # return mm * -0.04378155 + (189.5944 - -0.04378155) / (
-        #     1 + (distance / 1.81124) ** 1.056448
-        # )
-        return (
-            30.79912
-            - 1.346418 * distance
-            + 0.03009753 * distance**2
-            - 0.0003733656 * distance**3
-            + 0.000002521213 * distance**4
-            - 7.49986e-9 * distance**5
+        self.smallImage = DisplayBuffer.from_image(
+            self.displaySource(), self.coords.device_size
         )
-
-    def how_many_mm_per_pixels_at_distance_on_big_image(self, distance, no_pixels):
-        assert distance >= 15.0, "Distance must be bigger than 15 cms"
-        pixels_per_mm = self.how_many_pixels_per_mm_at_distance_on_big_image(
-            distance, 1
+        depth_cm = measurements.metric_depth_grid(
+            self.depthmap, self.float_min_value, self.float_max_value
+        )
+        depth_cm.flags.writeable = False
+        self.overlays = OverlayCache(
+            self.depthArray,
+            depth_cm,
+            self.coords.device_size,
+            self.coords.device_pixel_ratio,
         )
-        return no_pixels / pixels_per_mm
+        self.updateOverlays()
 
-    def _loadImage(self, fileName):
-        self.filename = fileName
+        self.region.clear()
+        self.regionEngine = None
+        self.updateRegion()
 
-        try:
-            self.portrait: IOSPortrait = load_image(self.filename)
-            self.image = self.portrait.photo
-            self.depthmap = self.portrait.depthmap
-            self.teethmap = self.portrait.teethmap
-            self.float_min_value = self.portrait.floatValueMin
-            self.float_max_value = self.portrait.floatValueMax
+        self.calibration = calibration.for_device(preview.device_model)
+        self.rubberBand = None
+        self.updateRubberBand()
+        self.ui.open3DViewButton.setEnabled(False)
+        self.ui.exportButton.setEnabled(False)
+        self.ui.exportMeshButton.setEnabled(False)
 
-            if self.float_max_value is not None:
-                self.float_max_value = float(self.float_max_value)
+        self.last_click_x = None
+        self.last_click_by_user = False
+        self.measurements = []
+        self.redrawImage()
+        self.updateWindowTitle()
 
-            if self.float_min_value is not None:
-                self.float_min_value = float(self.float_min_value)
+        self.portraitLoader = PortraitLoader(fileName)
+        self.portraitLoader.signals.loaded.connect(self._portraitLoaded)
+        self.portraitLoader.signals.failed.connect(self._portraitFailed)
+        self.portraitLoader.start()
+
+    def remeasure(self, record):
+        """Measure a recorded click again, with the current coordinate system"""
+        return measurements.point_pair(
+            self.depthArray,
+            self.overlays.depth_cm,
+            self.coords,
+            record["x1"],
+            record["y1"],
+            record["x2"],
+            record["y2"],
+            self.calibration,
+            const.PROFILE_SAMPLES_PER_PIXEL,
+            const.PROFILE_INTERPOLATION,
+        )
 
-            # self.depthmap = self.depthmap.filter(ImageFilter.GaussianBlur)
-        except ExifValidationFailed as e:
-            QMessageBox.critical(
-                self,
-                tr("FIDMAA notification"),
-                errors.NO_FRONT_CAMERA_NOTIFICATION.format(exif_camera_description=e),
-            )
+    def _portraitFailed(self, fileName, exception):
+        if fileName != self.filename:
+            # User opened another file in the meantime
             return
 
-        except NoDepthMapFound:
-            self.critical_error(errors.NO_DEPTH_DATA_ERROR)
-            return
+        tb_text = "".join(traceback.format_exception(exception))
+        self.critical_error(f"Exception: {tb_text}")
+        print(tb_text)
 
-        except UnknownExtension as e:
-            self.critical_error(QObject.tr("Unknown file extension (%s)" % e))
+    def _portraitLoaded(self, fileName, portrait, face):
+        if fileName != self.filename:
+            # User opened another file in the meantime
             return
 
-        self.smallImage = self.image.resize((480, 640))
+        self.portrait: IOSPortrait = portrait
+        self.image = self.portrait.photo
+        self.teethmap = self.portrait.teethmap
+        if self.image.size != self.coords.photo_size:
+            # The size declared in the container may differ from the decoded
+            # one (iPhone 14: width + 4, height - 1). Anything measured with
+            # the preview scale is measured again with the decoded one:
+            self.coords = self.coordinateSystem(self.image.size, self.coords.depth_size)
+            self.measurements = [self.remeasure(record) for record in self.measurements]
+
+        self.imageArray = numpy.asarray(self.image)
+        self.previewArray = None
+        self.smallImage = DisplayBuffer.from_image(
+            self.imageArray, self.coords.device_size
+        )
+        self.ui.open3DViewButton.setEnabled(True)
+        self.ui.exportButton.setEnabled(True)
+        self.ui.exportMeshButton.setEnabled(True)
+
+        self.regionEngine = None
+        self.updateRegion()
+        self.rubberBand = None
 
         # If pictures taken with the back camera, the main miage should be mirrored to match
         # the depth map... then the depth map should be mirrored if printing in 3D... currently
@@ -658,24 +749,23 @@ class MainWindow(UILoaderMixin, QWidget):
         # self.depthmap = ImageOps.mirror(self.depthmap)
 
         #
-        # Get face position, if any:
+        # Face position, if any, was found by the loader:
         #
 
-        try:
-            self.face = get_face_parameters(self.image, raise_opencv_exceptions=True)
-        except NoFacesDetected:
+        if isinstance(face, NoFacesDetected):
             self.face = None
             self.critical_error(errors.FACE_NOT_DETECTED)
 
-        except MultipleFacesDetected:
+        elif isinstance(face, MultipleFacesDetected):
             self.critical_error(errors.MULTIPLE_FACES_DETECTED)
 
-        except BaseException:
-            tb_text = traceback.format_exc()
+        elif isinstance(face, BaseException):
+            tb_text = "".join(traceback.format_exception(face))
             self.critical_error(f"Exception: {tb_text}")
             print(tb_text)
 
         else:
+            self.face = face
             percent_width, percent_height = self.face.calculate_percentage_of_image()
             if (
                 percent_width < const.MINIMUM_FACE_WIDTH_PERCENT
@@ -692,22 +782,121 @@ class MainWindow(UILoaderMixin, QWidget):
 
             # Set lower point somewhere around mouth (below nose, above chin)
 
-            self.ui.xValue.setValue(
-                int(round(self.face.center_x / self.image.size[0] * 479))
-            )
-            self.ui.yValue.setValue(
-                int(
-                    round(
-                        (self.face.center_y + self.face.height / 4)
-                        / self.image.size[1]
-                        * 639
-                    )
-                )
-            )
+            x, y = measurements.face_midline_point(self.face, self.coords)
+            self.ui.xValue.setValue(x)
+            self.ui.yValue.setValue(y)
 
         self.last_click_x = None
+        self.last_click_by_user = False
+        self.updateRubberBand()
         self.redrawImage()
-        self.updateWindowTitle()
+
+    def updateOverlays(self, *args, **kw):
+        if self.overlays is None:
+            return
+
+        if self.ui.depthOverlayCheckBox.isChecked():
+            self.depthOverlayLabel.setPixmap(self.overlays.depth_colormap())
+            self.depthOverlayLabel.show()
+        else:
+            self.depthOverlayLabel.hide()
+
+        if self.ui.contoursCheckBox.isChecked():
+            self.contoursLabel.setPixmap(
+                self.overlays.contours(self.ui.contourStepValue.value())
+            )
+            self.contoursLabel.show()
+        else:
+            self.contoursLabel.hide()
+
+    def updateRegion(self, *args, **kw):
+        """Repaint the polygon and measure the region inside of it"""
+        canvas = self.overlayCanvas()
+        painter = self.depthPainter(canvas)
+        painter.setPen(QColor(255, 0, 255, 255))
+        points = [QPointF(x, y) for x, y in self.region.vertices]
+        if self.region.is_closed():
+            painter.setBrush(QColor(255, 0, 255, 48))
+            painter.drawPolygon(points)
+        elif len(points) == 2:
+            painter.drawLine(*points)
+        for point in points:
+            painter.drawEllipse(point, 3, 3)
+        painter.end()
+
+        self.regionLabel.setPixmap(canvas)
+        self.regionLabel.setVisible(bool(points))
+
+        if not self.region.is_closed() or self.depthmap is None:
+            self.ui.regionResultLabel.clear()
+            return
+
+        if self.regionEngine is None:
+            self.regionEngine = RegionEngine(
+                self.overlays.depth_cm, self.coords, self.calibration
+            )
+
+        result = self.regionEngine.measure(self.region.vertices)
+        self.ui.regionResultLabel.setText(
+            f"Region surface area: {result.surface_area_cm2:.2f} cm²\n"
+            f"Volume above reference plane: {result.volume_cm3:.2f} cm³"
+        )
+
+    def updateRubberBand(self, mouse_x=None, mouse_y=None):
+        """Show lengths from the last click to the point under the mouse"""
+        if mouse_x is None or self.depthmap is None or self.last_click_x is None:
+            self.rubberBandLabel.hide()
+            self.ui.liveMeasurementLabel.clear()
+            return
+
+        mouse_x, mouse_y = self.coords.clamp(mouse_x, mouse_y)
+
+        if self.rubberBand is None:
+            self.rubberBand = RubberBand(
+                self.overlays.depth_cm,
+                self.coords,
+                const.PROFILE_SAMPLES_PER_PIXEL,
+                const.PROFILE_INTERPOLATION,
+                self.calibration,
+            )
+        self.rubberBand.set_anchor(self.last_click_x, self.last_click_y)
+        straight, surface = self.rubberBand.measure(mouse_x, mouse_y)
+
+        canvas = self.overlayCanvas()
+        painter = self.depthPainter(canvas)
+        painter.setPen(QColor(255, 128, 0, 200))
+        painter.drawLine(
+            QPoint(self.last_click_x, self.last_click_y), QPoint(mouse_x, mouse_y)
+        )
+        painter.end()
+        self.rubberBandLabel.setPixmap(canvas)
+        self.rubberBandLabel.show()
+
+        text = f"From last click: {straight:.2f} cm (3D), {surface:.2f} cm (surface)"
+        depth_cm = self.overlays.depth_cm
+        if not self.calibration.in_range(
+            [
+                depth_cm[self.last_click_y, self.last_click_x],
+                depth_cm[mouse_y, mouse_x],
+            ]
+        ).all():
+            text += " -- outside of the calibrated range"
+        self.ui.liveMeasurementLabel.setText(text)
+
+    def regionReleased(self, *args, **kw):
+        self.region.release()
+
+    def clearRegion(self, *args, **kw):
+        self.region.clear()
+        self.updateRegion()
+
+    def createOverlayLabel(self):
+        label = QLabel(self.ui.imageLabel)
+        label.setGeometry(0, 0, *self.coords.display_size)
+        label.setAttribute(Qt.WA_TransparentForMouseEvents)
+        label.hide()
+        self.overlayLabels.append(label)
+        return label
 
     def getWindowTitle(self, fileName=None, fun=None):
         ret = "FIDMAA GUI"
@@ -736,6 +925,28 @@ class MainWindow(UILoaderMixin, QWidget):
             self.zoomWindow.show()
             self.zoomWindow.raise_()
 
+    def browseDirectory(self, *args, **kw):
+        settings = QSettings("FIDMAA - open file")
+        last_directory_used = settings.value(
+            const.LAST_DIRECTORY_USED, os.path.expanduser("~/Downloads")
+        )
+
+        directory = QFileDialog.getExistingDirectory(
+            self, QObject.tr("Browse directory"), last_directory_used
+        )
+        if not directory:
+            return
+        settings.setValue(const.LAST_DIRECTORY_USED, directory)
+
+        if self.thumbnailBrowser is None:
+            self.thumbnailBrowser = ThumbnailBrowser(directory)
+            self.thumbnailBrowser.fileSelected.connect(self._loadImage)
+        else:
+            self.thumbnailBrowser.setDirectory(directory)
+
+        self.thumbnailBrowser.show()
+        self.thumbnailBrowser.raise_()
+
     def loadJPEG(self, *args, **kw):
         settings = QSettings("FIDMAA - open file")
         last_directory_used = settings.value(
@@ -758,9 +969,119 @@ class MainWindow(UILoaderMixin, QWidget):
             settings.setValue(const.LAST_DIRECTORY_USED, os.path.dirname(fileName))
             self._loadImage(fileName)
 
+    def exportMeasurements(self, *args, **kw):
+        if not self.portrait:
+            return
+
+        settings = QSettings("FIDMAA - open file")
+        directory = QFileDialog.getExistingDirectory(
+            self,
+            QObject.tr("Export measurements to directory"),
+            settings.value(
+                const.LAST_EXPORT_DIRECTORY_USED, os.path.dirname(self.filename)
+            ),
+        )
+        if not directory:
+            return
+        settings.setValue(const.LAST_EXPORT_DIRECTORY_USED, directory)
+
+        # The same grid as measured and painted on screen:
+        depth_cm = self.overlays.depth_cm
+        format_name = self.ui.exportFormatComboBox.currentText()
+        try:
+            session = export.ExportSession(directory, format_name)
+        except export.OutputExists as e:
+            answer = QMessageBox.question(
+                self,
+                tr("FIDMAA notification"),
+                tr("%s\n\nReplace these files?") % e,
+            )
+            if answer != QMessageBox.Yes:
+                return
+            session = export.ExportSession(directory, format_name, overwrite=True)
+
+        if session.is_done(self.filename):
+            # Appending again would duplicate its rows and manifest entry
+            session.close()
+            QMessageBox.information(
+                self,
+                tr("FIDMAA notification"),
+                tr(
+                    "%s was already exported to this directory, skipping it. "
+                    "Choose another directory to export it again."
+                )
+                % os.path.basename(self.filename),
+            )
+            return
+
+        try:
+            session.export(
+                self.filename,
+                export.portrait_records(
+                    self.portrait,
+                    depth_cm,
+                    midline=(
+                        self.ui.xValue.value(),
+                        self.ui.yValue.value(),
+                        self.ui.angleValue.value(),
+                    ),
+                    clicks=self.measurements,
+                    ppm_model=self.calibration,
+                    coords=self.coords,
+                ),
+                depth_cm,
+            )
+        except Exception:
+            session.rollback()
+            tb_text = traceback.format_exc()
+            self.critical_error(f"Exception: {tb_text}")
+        finally:
+            session.close()
+
+    def exportMesh(self, *args, **kw):
+        if not self.portrait:
+            return
+
+        settings = QSettings("FIDMAA - open file")
+        fileName, _ = QFileDialog.getSaveFileName(
+            self,
+            QObject.tr("Export 3D mesh"),
+            os.path.join(
+                settings.value(
+                    const.LAST_EXPORT_DIRECTORY_USED, os.path.dirname(self.filename)
+                ),
+                Path(self.filename).stem + ".ply",
+            ),
+            QObject.tr("PLY (*.ply);;STL (*.stl);;OBJ (*.obj)"),
+        )
+        if not fileName:
+            return
+        settings.setValue(const.LAST_EXPORT_DIRECTORY_USED, os.path.dirname(fileName))
+
+        try:
+            mesh.export_mesh(
+                fileName,
+                self.overlays.depth_cm,
+                self.coords,
+                self.image,
+                scale=const.MESH_EXPORT_SCALE,
+                thickness_mm=const.MESH_EXPORT_THICKNESS_MM,
+                calibration=self.calibration,
+            )
+        except Exception:
+            tb_text = traceback.format_exc()
+            self.critical_error(f"Exception: {tb_text}")
+
     def setMidlinePoint(self, point, *args, **kw):
-        self.ui.xValue.setValue(point.x())
-        self.ui.yValue.setValue(point.y())
+        x, y = self.coords.display_to_depth_pixel(point.x(), point.y())
+        if self.ui.regionCheckBox.isChecked():
+            self.region.press(x, y)
+            self.updateRegion()
+            return
+
+        self.ui.xValue.setValue(x)
+        self.ui.yValue.setValue(y)
+        self.user_click = True
         self.redrawImage()
 
     def setMidlineY(self, point, *args, **kw):
@@ -801,16 +1122,29 @@ class MainWindow(UILoaderMixin, QWidget):
         plotter.add_text("FIDMAA (C) 2022-2024 Michal Pasternak & collaborators ")
         plotter.show()
 
+    def closeEvent(self, event):
+        self.reportWorker.shutdown()
+        super().closeEvent(event)
+
     def connect_ui(self):
-        canvas = QtGui.QPixmap(480, 640)
+        # Until a portrait is loaded, the photo is as big as the depth map:
+        self.coords = self.coordinateSystem(DEPTHMAP_SIZE)
+        self.overlayLabels = []
+        self.screenChangeConnected = False
+
+        canvas = QtGui.QPixmap(*self.coords.device_size)
+        canvas.setDevicePixelRatio(self.coords.device_pixel_ratio)
         self.ui.imageLabel.setPixmap(canvas)
 
-        canvas = QtGui.QPixmap(255, 640)
+        canvas = QtGui.QPixmap(255, self.coords.depth_height)
         self.ui.chartLabel.setPixmap(canvas)
 
         self.ui.showZoomWindowButton.clicked.connect(self.showZoomWindow)
         self.ui.loadJPEGButton.clicked.connect(self.loadJPEG)
+        self.ui.browseDirectoryButton.clicked.connect(self.browseDirectory)
+        self.ui.exportButton.clicked.connect(self.exportMeasurements)
         self.ui.open3DViewButton.clicked.connect(self.open3DView)
+        self.ui.exportMeshButton.clicked.connect(self.exportMesh)
         self.ui.imageLabel.clicked.connect(self.setMidlinePoint)
         self.ui.imageLabel.setMouseTracking(True)
         self.ui.imageLabel.mouseMoveEvent = self.redrawZoom
@@ -819,6 +1153,17 @@ class MainWindow(UILoaderMixin, QWidget):
 
         self.ui.angleValue.valueChanged.connect(self.redrawImage)
 
+        self.depthOverlayLabel = self.createOverlayLabel()
+        self.contoursLabel = self.createOverlayLabel()
+        self.regionLabel = self.createOverlayLabel()
+        self.rubberBandLabel = self.createOverlayLabel()
+        self.ui.depthOverlayCheckBox.toggled.connect(self.updateOverlays)
+        self.ui.contoursCheckBox.toggled.connect(self.updateOverlays)
+        self.ui.contourStepValue.valueChanged.connect(self.updateOverlays)
+
+        self.ui.imageLabel.released.connect(self.regionReleased)
+        self.ui.clearRegionButton.clicked.connect(self.clearRegion)
+
         self.ui.angleValue.setValue(90)
         self.ui.angleSlider.setValue(90)
 
@@ -2,13 +2,16 @@ import math
 
 from PySide6.QtCore import QPoint
 
+from .calibration_model import DEFAULT as DEFAULT_CALIBRATION
+
 
 def findPoint(
     startX,
     startY,
     direction=1,
-    maxWidth=480,
-    maxHeight=640,
+    *,
+    maxWidth,
+    maxHeight,
     angle=None,
     linear_coefficient=None,
 ):
@@ -58,3 +61,55 @@ def findParalellPoint(midpointX, midpointY, angle, distance, direction=1):
     lpy1 = midpointY + direction * math.cos(math.radians(-angle)) * distance
 
     return (lpx1, lpy1)
+
+
+def clamp(n, minn, maxn):
+    return max(min(maxn - 1, n), minn)
+
+
+def depthmap_value_to_distance(value, float_min_value, float_max_value):
+    """Returns a distance from a given depthMap value (or an array of values)
+    in centimeters using EXIF data from TrueDepth[tm] camera
+
+    :returns: distance in centimeters
+    """
+    return (
+        100
+        * 1.0
+        / (float_max_value * value / 255 + float_min_value * (1 - value / 255))
+    )
+
+
+def how_many_pixels_per_mm_at_distance_on_big_image(distance, mm, calibration=None):
+    """Returns how many pixels take up a 1 milimiter at a given distance (cm) from camera.
+
+    Distances outside of the calibrated range are clamped to it, see `calibration`.
+
+    :param distance: The distance in centimeters from the camera (a number or an array)
+    :param calibration: `calibration.CalibrationModel` of the device, default if None
+    """
+    if calibration is None:
+        calibration = DEFAULT_CALIBRATION
+    return calibration.pixels_per_mm(distance)
+
+
+def how_many_mm_per_pixels_at_distance_on_big_image(
+    distance, no_pixels, calibration=None
+):
+    """
+    :param no_pixels: line length in pixels, must be in original image size (2300x3000)
+    """
+    pixels_per_mm = how_many_pixels_per_mm_at_distance_on_big_image(
+        distance, 1, calibration
+    )
+    return no_pixels / pixels_per_mm
+
+
+def vector_length_simple(x1, y1, z1, x2, y2, z2):
+    """Simple mathematical lenght of the vector"""
+    return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2)
+
+
+def calculate_line_length(dist_x, dist_y):
+    line_len = math.sqrt(abs(dist_x * dist_x) + abs(dist_y * dist_y))
+    return line_len
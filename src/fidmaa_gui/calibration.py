@@ -0,0 +1,205 @@
+"""Calibration of the pixel/mm scale of TrueDepth photos.
+
+How many pixels of the full-resolution photo take up a milimeter depends on
+the distance from the camera and on the device. The scale is modelled as
+a polynomial of the distance, valid between the shortest and the longest
+distance it was fitted on; outside of that range the distance is clamped
+to it and `CalibrationModel.in_range` tells which values were affected.
+
+Coefficients are stored per device model (the EXIF "Model" tag, for example
+"iPhone 12 Pro") in a JSON file in the user's data directory. Devices
+without their own coefficients use `DEFAULT`, fitted on the original
+calibration data. The model itself is in `calibration_model`, which does
+not depend on Qt or on the HEIF libraries.
+
+New coefficients are fitted from a directory of calibration shots with
+`fidmaa_calibrate DIRECTORY`. Next to the photos, the directory must contain
+`calibration.csv` with one row per segment of known length::
+
+    file,x1,y1,x2,y2,length_mm
+    IMG_0001.HEIC,120,300,360,302,80
+
+Points are in the depth map space (480x640), like the clicks in the main
+window; both ends of a segment should be at the same distance from the camera.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+import piexif
+import pyheif
+from PySide6.QtCore import QStandardPaths
+
+from . import const
+from .calibration_model import DEFAULT, DEFAULT_DEGREE, CalibrationModel, fit
+
+CALIBRATION_FILENAME = "calibration.json"
+SHOTS_FILENAME = "calibration.csv"
+
+
+#
+# Coefficients per device
+#
+
+
+def calibration_path():
+    """The same file for every entry point: `AppDataLocation` would depend
+    on the name of the QCoreApplication, if any"""
+    return os.path.join(
+        QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation),
+        const.DATA_DIRECTORY_NAME,
+        CALIBRATION_FILENAME,
+    )
+
+
+def load_calibrations(path=None):
+    """{device model: CalibrationModel}; empty if nothing was calibrated yet"""
+    if path is None:
+        path = calibration_path()
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        device: CalibrationModel.from_dict(values, device)
+        for device, values in data.get("devices", {}).items()
+    }
+
+
+def save_calibrations(calibrations, path=None):
+    if path is None:
+        path = calibration_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    data = {
+        "devices": {
+            device: model.to_dict() for device, model in sorted(calibrations.items())
+        }
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def device_model(exif):
+    """Device model from EXIF data loaded by piexif"""
+    value = exif.get("0th", {}).get(piexif.ImageIFD.Model)
+    if isinstance(value, bytes):
+        value = value.decode("ascii", errors="replace").rstrip("\x00")
+    return value
+
+
+def device_model_of_file(fileName):
+    """Device model of a HEIC file, read from the container without decoding
+    any pixels; None if there is no EXIF data"""
+    try:
+        with open(fileName, "rb") as f:
+            heif_container = pyheif.open_container(f)
+    except Exception:
+        return
+
+    for metadata in heif_container.primary_image.image.metadata or []:
+        if metadata.get("type", "") == "Exif":
+            return device_model(piexif.load(metadata["data"]))
+
+
+def for_device(device, calibrations=None):
+    """Calibration for a device model, `DEFAULT` if it was not calibrated"""
+    if calibrations is None:
+        calibrations = load_calibrations()
+    return calibrations.get(device, DEFAULT)
+
+
+#
+# Fitting from calibration shots
+#
+
+
+def read_shots(directory):
+    """Measured scales from the calibration shots in a directory.
+
+    :returns: {device model: ([distances in cm], [pixels per mm])}
+    """
+    # Imported here, as the loading module imports this one:
+    from .coordinates import CoordinateSystem
+    from .loading import load_depth_preview
+    from .measurements import metric_depth_grid
+
+    previews = {}
+    ret = {}
+
+    with open(
+        os.path.join(directory, SHOTS_FILENAME), newline="", encoding="utf-8"
+    ) as f:
+        for row in csv.DictReader(f):
+            fileName = os.path.join(directory, row["file"])
+            if fileName not in previews:
+                preview = load_depth_preview(fileName)
+                depth_cm = metric_depth_grid(
+                    preview.depthmap, preview.floatValueMin, preview.floatValueMax
+                )
+                previews[fileName] = (
+                    depth_cm,
+                    CoordinateSystem(
+                        preview.photo_size, (depth_cm.shape[1], depth_cm.shape[0])
+                    ),
+                    device_model_of_file(fileName),
+                )
+            depth_cm, coords, device = previews[fileName]
+
+            x1, y1, x2, y2 = (int(row[name]) for name in ("x1", "y1", "x2", "y2"))
+            distance = (depth_cm[y1, x1] + depth_cm[y2, x2]) / 2.0
+
+            pixels = math.hypot(*coords.depth_to_photo(x2 - x1, y2 - y1))
+
+            distances, scales = ret.setdefault(device, ([], []))
+            distances.append(distance)
+            scales.append(pixels / float(row["length_mm"]))
+
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit the pixel/mm calibration from a directory of calibration shots"
+    )
+    parser.add_argument(
+        "directory", help=f"directory with HEIC files and {SHOTS_FILENAME}"
+    )
+    parser.add_argument("--degree", type=int, default=DEFAULT_DEGREE)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help=f"calibration file to update (default: {calibration_path()})",
+    )
+    args = parser.parse_args()
+
+    calibrations = load_calibrations(args.output)
+
+    for device, (distances, scales) in read_shots(args.directory).items():
+        if device is None:
+            print(
+                f"Skipping {len(distances)} samples without a device model",
+                file=sys.stderr,
+            )
+            continue
+
+        try:
+            model = fit(distances, scales, args.degree, device)
+        except ValueError as e:
+            print(f"{device}: {e}", file=sys.stderr)
+            continue
+
+        calibrations[device] = model
+        print(
+            f"{device}: {model.samples} samples, "
+            f"{model.min_distance:.1f}-{model.max_distance:.1f} cm, "
+            f"RMS error {model.rms_error:.4f} px/mm"
+        )
+
+    save_calibrations(calibrations, args.output)
@@ -0,0 +1,120 @@
+"""Pixel/mm scale of TrueDepth photos as a polynomial of the distance.
+
+Only depends on NumPy, so that the measurement code can use it without
+Qt or the HEIF libraries; storage of the coefficients per device and the
+fitting tool are in `calibration`.
+"""
+
+import numpy
+
+DEFAULT_DEGREE = 5
+
+
+class CalibrationModel:
+    """Pixels per milimeter as a polynomial of the distance in centimeters.
+
+    :param coefficients: lowest order first
+    """
+
+    def __init__(
+        self,
+        coefficients,
+        min_distance,
+        max_distance,
+        device=None,
+        samples=None,
+        rms_error=None,
+    ):
+        self.coefficients = tuple(float(value) for value in coefficients)
+        self.min_distance = float(min_distance)
+        self.max_distance = float(max_distance)
+        self.device = device
+        self.samples = samples
+        self.rms_error = rms_error
+
+    def __repr__(self):
+        return (
+            f"<CalibrationModel {self.device or 'default'} "
+            f"{self.min_distance:.1f}-{self.max_distance:.1f} cm>"
+        )
+
+    def in_range(self, distance):
+        """True where the distance lies within the calibrated range"""
+        distance = numpy.asarray(distance)
+        return (distance >= self.min_distance) & (distance <= self.max_distance)
+
+    def pixels_per_mm(self, distance):
+        """Evaluate the polynomial with Horner's rule, for a number or an array.
+        Distances outside of the calibrated range are clamped to it."""
+        distance = numpy.clip(distance, self.min_distance, self.max_distance)
+        ret = 0.0
+        for coefficient in reversed(self.coefficients):
+            ret = ret * distance + coefficient
+        return ret
+
+    def mm_per_pixels(self, distance, no_pixels):
+        return no_pixels / self.pixels_per_mm(distance)
+
+    def to_dict(self):
+        return {
+            "coefficients": list(self.coefficients),
+            "min_distance_cm": self.min_distance,
+            "max_distance_cm": self.max_distance,
+            "samples": self.samples,
+            "rms_error": self.rms_error,
+        }
+
+    @classmethod
+    def from_dict(cls, data, device=None):
+        return cls(
+            data["coefficients"],
+            data["min_distance_cm"],
+            data["max_distance_cm"],
+            device=device,
+            samples=data.get("samples"),
+            rms_error=data.get("rms_error"),
+        )
+
+
+# Constants taken from own calibration data and a curve fitted by MyCurveFit.com.
+# Distances are clamped to the calibrated 15-80 cm: beyond it the curve keeps
+# falling towards zero (0.89 px/mm at 100 cm) and turns negative at about 104 cm.
+DEFAULT = CalibrationModel(
+    [
+        30.79912,
+        -1.346418,
+        0.03009753,
+        -0.0003733656,
+        0.000002521213,
+        -7.49986e-9,
+    ],
+    min_distance=15.0,
+    max_distance=80.0,
+)
+
+
+def fit(distances, pixels_per_mm, degree=DEFAULT_DEGREE, device=None):
+    """Least-squares fit of a polynomial to measured scales.
+
+    Distances are mapped to [-1, 1] for the fit, as the Vandermonde matrix
+    of raw distances is badly conditioned from degree 3 on; the coefficients
+    are converted back to powers of the distance in centimeters."""
+    distances = numpy.asarray(distances, dtype=numpy.float64)
+    pixels_per_mm = numpy.asarray(pixels_per_mm, dtype=numpy.float64)
+    if len(distances) <= degree:
+        raise ValueError(
+            f"Fitting a polynomial of degree {degree} needs more than "
+            f"{degree} samples, got {len(distances)}"
+        )
+
+    polynomial = numpy.polynomial.Polynomial.fit(distances, pixels_per_mm, degree)
+    residuals = polynomial(distances) - pixels_per_mm
+
+    return CalibrationModel(
+        polynomial.convert().coef,
+        distances.min(),
+        distances.max(),
+        device=device,
+        samples=len(distances),
+        rms_error=float(numpy.sqrt(numpy.mean(residuals**2))),
+    )
@@ -2,3 +2,19 @@ MINIMUM_FACE_WIDTH_PERCENT = 0.55
 MINIMUM_FACE_HEIGHT_PERCENT = 0.4
 TRUEDEPTH_EXIF_ID = "front TrueDepth"
 LAST_DIRECTORY_USED = "last_directory_used"
+LAST_EXPORT_DIRECTORY_USED = "last_export_directory_used"
+# Face detection runs on the photo reduced by a power of two, so that its longer
+# side is at most this many pixels:
+FACE_DETECTION_MAX_SIZE = 800
+FACE_DETECTION_REFINE_EYES = True
+# Depth profiles (chart, reconstruction, surface lengths) are interpolated
+# between pixels: "nearest", "bilinear" or "bicubic"
+PROFILE_INTERPOLATION = "bilinear"
+PROFILE_SAMPLES_PER_PIXEL = 1.0
+# Resampling of the depth grid for 3D mesh export (above 1.0 upsamples it
+# towards the resolution of the photo) and thickness of the base behind the face:
+MESH_EXPORT_SCALE = 1.0
+MESH_EXPORT_THICKNESS_MM = 5.0
+# Directory in the user's generic data location, the same for the GUI and
+# the command line tools, which do not create a QCoreApplication:
+DATA_DIRECTORY_NAME = "fidmaa_gui"
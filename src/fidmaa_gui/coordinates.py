@@ -0,0 +1,210 @@
+"""Coordinate spaces of a portrait and the transforms between them.
+
+There are four spaces:
+
+- the full-resolution photo, in which the pixel/mm calibration is expressed,
+- the depth map (480x640), in which clicks and measurements are made,
+- the display, where the depth map and the photo are painted, in logical
+  (device independent) pixels,
+- the device pixels of the display, which differ from the logical ones on
+  HiDPI screens by the device pixel ratio.
+
+`CoordinateSystem` is built once per portrait. Scale factors and the grid of
+photo coordinates of every depth map pixel are computed once and shared by
+all the measurements, so no code path needs to recompute them, or to know
+the 480x640 constants.
+
+Metric x and y are back-projected from the principal point -- where the camera
+axis crosses the photo -- so that a segment measures the same anywhere in the
+frame. Without the intrinsics of the camera, the center of the photo is used.
+"""
+
+import numpy
+
+from . import calculations
+
+DEPTHMAP_SIZE = (480, 640)
+
+
+class CoordinateSystem:
+    """Transforms between the photo, depth map and display spaces.
+
+    All the transforms take numbers or arrays of the same shape.
+
+    :param photo_size: (width, height) of the full-resolution photo
+    :param depth_size: (width, height) of the depth map
+    :param display_size: (width, height) the depth map is painted at,
+        in logical pixels; the depth map size by default
+    :param device_pixel_ratio: device pixels per logical pixel
+    :param principal_point: (x, y) of the principal point in the photo;
+        the center of the photo by default
+    """
+
+    def __init__(
+        self,
+        photo_size,
+        depth_size=DEPTHMAP_SIZE,
+        display_size=None,
+        device_pixel_ratio=1.0,
+        principal_point=None,
+    ):
+        self.photo_size = tuple(photo_size)
+        if principal_point is None:
+            principal_point = (self.photo_size[0] / 2.0, self.photo_size[1] / 2.0)
+        self.principal_point = tuple(principal_point)
+        self.depth_size = tuple(depth_size)
+        self.display_size = tuple(display_size or depth_size)
+        self.device_pixel_ratio = float(device_pixel_ratio)
+
+        depth_width, depth_height = self.depth_size
+        # Photo pixels per depth map pixel:
+        self.photo_scale = (
+            self.photo_size[0] / depth_width,
+            self.photo_size[1] / depth_height,
+        )
+        # Logical display pixels per depth map pixel:
+        self.display_scale = (
+            self.display_size[0] / depth_width,
+            self.display_size[1] / depth_height,
+        )
+        self.device_size = (
+            int(round(self.display_size[0] * self.device_pixel_ratio)),
+            int(round(self.display_size[1] * self.device_pixel_ratio)),
+        )
+        self._photo_grid = None
+
+    def __repr__(self):
+        return (
+            f"<CoordinateSystem photo={self.photo_size} depth={self.depth_size} "
+            f"display={self.display_size}@{self.device_pixel_ratio:g}x>"
+        )
+
+    @classmethod
+    def for_portrait(cls, portrait, depth_cm=None, **kwargs):
+        """Coordinate system of a portrait loaded by `portrait_analyser`"""
+        depth_size = DEPTHMAP_SIZE
+        if depth_cm is not None:
+            depth_size = (depth_cm.shape[1], depth_cm.shape[0])
+        return cls(portrait.photo.size, depth_size, **kwargs)
+
+    def with_display(self, display_size=None, device_pixel_ratio=None):
+        """The same portrait painted at another size or on another screen;
+        shares the cached photo grid, which does not depend on the display"""
+        if device_pixel_ratio is None:
+            device_pixel_ratio = self.device_pixel_ratio
+        ret = CoordinateSystem(
+            self.photo_size,
+            self.depth_size,
+            display_size,
+            device_pixel_ratio,
+            self.principal_point,
+        )
+        ret._photo_grid = self._photo_grid
+        return ret
+
+    @property
+    def depth_width(self):
+        return self.depth_size[0]
+
+    @property
+    def depth_height(self):
+        return self.depth_size[1]
+
+    #
+    # Depth map <-> photo
+    #
+
+    def depth_to_photo(self, x, y):
+        return x * self.photo_scale[0], y * self.photo_scale[1]
+
+    def photo_to_depth(self, x, y):
+        return x / self.photo_scale[0], y / self.photo_scale[1]
+
+    def photo_to_depth_pixel(self, x, y):
+        """Nearest depth map pixel of a point of the photo, spreading the photo
+        over the centers of the first and the last pixel"""
+        return (
+            int(round(x / self.photo_size[0] * (self.depth_width - 1))),
+            int(round(y / self.photo_size[1] * (self.depth_height - 1))),
+        )
+
+    def photo_grid(self):
+        """Photo coordinates of every depth map pixel, relative to the principal
+        point, as (xs, ys) arrays of the depth map shape. Computed once, do
+        not modify."""
+        if self._photo_grid is None:
+            ys, xs = numpy.mgrid[0 : self.depth_height, 0 : self.depth_width]
+            xs, ys = self.depth_to_photo(xs, ys)
+            xs -= self.principal_point[0]
+            ys -= self.principal_point[1]
+            xs.flags.writeable = False
+            ys.flags.writeable = False
+            self._photo_grid = xs, ys
+        return self._photo_grid
+
+    def to_mm(self, distance_cm, x, y, calibration=None):
+        """Metric (x, y) in milimeters of a depth map point at a distance,
+        relative to the camera axis"""
+        photo_x, photo_y = self.depth_to_photo(x, y)
+        return (
+            calculations.how_many_mm_per_pixels_at_distance_on_big_image(
+                distance_cm, photo_x - self.principal_point[0], calibration
+            ),
+            calculations.how_many_mm_per_pixels_at_distance_on_big_image(
+                distance_cm, photo_y - self.principal_point[1], calibration
+            ),
+        )
+
+    def from_mm(self, distance_cm, mm_x, mm_y, calibration=None):
+        """Depth map point of a metric (x, y) at a distance, inverse of `to_mm`"""
+        pixels_per_mm = calculations.how_many_pixels_per_mm_at_distance_on_big_image(
+            distance_cm, 1, calibration
+        )
+        return self.photo_to_depth(
+            mm_x * pixels_per_mm + self.principal_point[0],
+            mm_y * pixels_per_mm + self.principal_point[1],
+        )
+
+    def pixel_footprint_mm(self, distance_cm, calibration=None):
+        """Width and height in milimeters of a depth map pixel at a distance"""
+        return (
+            calculations.how_many_mm_per_pixels_at_distance_on_big_image(
+                distance_cm, self.photo_scale[0], calibration
+            ),
+            calculations.how_many_mm_per_pixels_at_distance_on_big_image(
+                distance_cm, self.photo_scale[1], calibration
+            ),
+        )
+
+    #
+    # Depth map <-> display
+    #
+
+    def depth_to_display(self, x, y):
+        return x * self.display_scale[0], y * self.display_scale[1]
+
+    def display_to_depth(self, x, y):
+        return x / self.display_scale[0], y / self.display_scale[1]
+
+    def display_to_depth_pixel(self, x, y):
+        """Depth map pixel under a point of the display, clamped to the depth map"""
+        x, y = self.display_to_depth(x, y)
+        return self.clamp(int(x), int(y))
+
+    def display_to_photo(self, x, y):
+        return self.depth_to_photo(*self.display_to_depth(x, y))
+
+    def display_to_device(self, x, y):
+        return x * self.device_pixel_ratio, y * self.device_pixel_ratio
+
+    def clamp(self, x, y):
+        """Clamp a depth map point to the depth map"""
+        return (
+            calculations.clamp(x, 0, self.depth_width),
+            calculations.clamp(y, 0, self.depth_height),
+        )
+
+    def rect_to_depth(self, rect):
+        """(x, y, width, height) of a `portrait_analyser` rectangle of the photo,
+        in depth map coordinates"""
+        return rect.translate_coordinates(*self.depth_size)
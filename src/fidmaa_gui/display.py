@@ -0,0 +1,137 @@
+"""NumPy arrays displayed by Qt without copying.
+
+`PIL.Image.toqimage()` allocates and copies a new buffer every time the image
+is painted. Here, images live as NumPy arrays and a `QImage` is created once,
+pointing directly at the array memory. `QImage` does not own that memory, so
+the array must outlive the image -- `DisplayBuffer` keeps both together and
+hands out the `QImage` only through itself.
+
+Arrays are kept in RGB order, so `rgbSwapped()` is never needed.
+"""
+
+import cv2
+import numpy
+from PySide6.QtGui import QImage
+
+FORMATS = {
+    1: QImage.Format_Grayscale8,
+    3: QImage.Format_RGB888,
+    4: QImage.Format_RGBA8888,
+}
+
+# Same kernel as PIL.ImageFilter.SHARPEN
+SHARPEN_KERNEL = (
+    numpy.array(
+        [
+            [-2, -2, -2],
+            [-2, 32, -2],
+            [-2, -2, -2],
+        ],
+        dtype=numpy.float32,
+    )
+    / 16
+)
+
+
+def channels(array):
+    return 1 if array.ndim == 2 else array.shape[2]
+
+
+class DisplayBuffer:
+    """A C-contiguous uint8 array and a `QImage` sharing its memory.
+
+    Write into `array` in place and paint `qimage`; never replace `array`
+    with another object, as the image would point to freed memory.
+    """
+
+    def __init__(self, array):
+        if array.dtype != numpy.uint8:
+            raise ValueError(f"uint8 array expected, got {array.dtype}")
+
+        self.array = numpy.ascontiguousarray(array)
+        height, width = self.array.shape[:2]
+        self.qimage = QImage(
+            self.array.data,
+            width,
+            height,
+            self.array.strides[0],
+            FORMATS[channels(self.array)],
+        )
+
+    @classmethod
+    def empty(cls, width, height, channels=3):
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        return cls(numpy.zeros(shape, dtype=numpy.uint8))
+
+    @classmethod
+    def from_image(cls, image, size=None):
+        """Create a buffer from a PIL image, optionally resized to `size`"""
+        array = numpy.array(image)
+        if size is not None and (array.shape[1], array.shape[0]) != size:
+            array = cv2.resize(array, size, interpolation=cv2.INTER_AREA)
+        return cls(array)
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    def matches(self, width, height, channels_count):
+        return (
+            self.width == width
+            and self.height == height
+            and channels(self.array) == channels_count
+        )
+
+
+def ensure_buffer(buffer, width, height, channels_count):
+    """Return `buffer` or a new one, if it has a different shape"""
+    if buffer is None or not buffer.matches(width, height, channels_count):
+        return DisplayBuffer.empty(width, height, channels_count)
+    return buffer
+
+
+def zoom_into(source, center_x, center_y, crop_width, crop_height, out):
+    """Crop `crop_width` x `crop_height` pixels of `source` around the center
+    and scale them to fill `out` (a `DisplayBuffer`), in place.
+
+    Parts of the crop outside of the source are black, like `Image.crop` does.
+    """
+    scale_x = out.width / crop_width
+    scale_y = out.height / crop_height
+    # Pixel centers are at half-pixel offsets, like in `Image.resize`:
+    matrix = numpy.array(
+        [
+            [scale_x, 0, (crop_width / 2 - center_x + 0.5) * scale_x - 0.5],
+            [0, scale_y, (crop_height / 2 - center_y + 0.5) * scale_y - 0.5],
+        ],
+        dtype=numpy.float64,
+    )
+    cv2.warpAffine(
+        source,
+        matrix,
+        (out.width, out.height),
+        dst=out.array,
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+    return out
+
+
+def sharpen(buffer, times=1, scratch=None):
+    """Apply `ImageFilter.SHARPEN` to the buffer, in place.
+
+    :param scratch: `DisplayBuffer` of the same size, reused between calls;
+        allocated for this call only if None
+    """
+    scratch = ensure_buffer(
+        scratch, buffer.width, buffer.height, channels(buffer.array)
+    )
+    for _ in range(times):
+        cv2.filter2D(buffer.array, -1, SHARPEN_KERNEL, dst=scratch.array)
+        buffer.array[...] = scratch.array
+    return buffer
@@ -1,3 +1,5 @@
+import argparse
+
 from fidmaa_gui import app
 
 
@@ -5,5 +7,56 @@ def run():
     app.main()
 
 
+def export():
+    from fidmaa_gui.export import WRITERS, OutputExists, export_directory
+
+    parser = argparse.ArgumentParser(
+        description="Export FIDMAA measurements for a directory of portraits"
+    )
+    parser.add_argument("source", help="directory with HEIC files")
+    parser.add_argument("output", help="output directory")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument(
+        "--no-depth-grid",
+        action="store_true",
+        help="do not export the metric depth grid",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="truncate output files found in a directory without an export manifest",
+    )
+    args = parser.parse_args()
+
+    try:
+        export_directory(
+            args.source,
+            args.output,
+            args.format,
+            depth_grid=not args.no_depth_grid,
+            overwrite=args.overwrite,
+        )
+    except OutputExists as e:
+        parser.error(f"{e}; use --overwrite to replace them")
+
+
+def triage():
+    from fidmaa_gui.triage import main
+
+    main()
+
+
+def serve():
+    from fidmaa_gui.service import main
+
+    main()
+
+
+def calibrate():
+    from fidmaa_gui.calibration import main
+
+    main()
+
+
 if __name__ == "__main__":
     run()
@@ -0,0 +1,450 @@
+"""Streaming export of measurements to CSV, JSON Lines and compressed NPZ files.
+
+Records are written to the output directory as soon as they are computed, one
+portrait at a time, so exporting thousands of files runs in constant memory.
+After every portrait, the sizes of the output files are appended to a manifest;
+when an export is restarted, files are truncated to the last committed sizes and
+portraits already listed in the manifest are skipped.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import sys
+import traceback
+from abc import ABC, abstractmethod
+
+import numpy
+from portrait_analyser.ios import load_image
+
+from . import calibration, measurements, profiles
+from .coordinates import CoordinateSystem
+from .face_detection import detect_face
+
+MANIFEST_NAME = ".fidmaa-export-manifest.jsonl"
+
+RECORD_FIELDS = {
+    "click": (
+        "file",
+        "x1",
+        "y1",
+        "x2",
+        "y2",
+        "depth_cm",
+        "line_length_px",
+        "vector_length_voxels",
+        "vector_length_3d_cm",
+        "surface_length_cm",
+        "angle_deg",
+        "calibrated",
+    ),
+    "midline": ("file", "index", "x", "y", "raw", "depth_cm"),
+    "surface": ("file", "index", "x", "y", "depth_cm", "length_cm"),
+    "incisor": ("file", "x1", "y1", "x2", "y2", "distance_cm"),
+}
+
+
+class OutputExists(FileExistsError):
+    """Output files found in a directory without an export manifest"""
+
+
+def _to_python(value):
+    if isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+class ExportWriter(ABC):
+    """Base class for writers. Subclasses write records to the files
+    in `directory`, one portrait at a time."""
+
+    format_name = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filename = None
+        self._files = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _open(self, name):
+        if name not in self._files:
+            self._files[name] = open(self.path(name), "a", newline="", encoding="utf-8")
+        return self._files[name]
+
+    def begin_file(self, filename):
+        self.filename = filename
+
+    @abstractmethod
+    def write_record(self, kind, record):
+        pass
+
+    @abstractmethod
+    def write_grid(self, grid):
+        pass
+
+    def end_file(self):
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self.filename = None
+
+    def offsets(self):
+        """Sizes of the output files, used to resume an interrupted export"""
+        return {
+            name: os.path.getsize(self.path(name))
+            for name in self.owned_files()
+            if os.path.exists(self.path(name))
+        }
+
+    def owned_files(self):
+        return []
+
+    def portrait_output(self, filename):
+        """Name of the file written for this portrait only, if any"""
+        return None
+
+    def truncate(self, offsets):
+        """Remove anything written after the last committed portrait"""
+        for name in self.owned_files():
+            path = self.path(name)
+            if os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(offsets.get(name, 0))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class CSVWriter(ExportWriter):
+    """One CSV file per kind of record; the depth grid is written
+    as one row per scanline."""
+
+    format_name = "csv"
+
+    def owned_files(self):
+        return [f"{kind}.csv" for kind in RECORD_FIELDS] + ["depth_grid.csv"]
+
+    def _writer(self, name, header):
+        f = self._open(name)
+        if f.tell() == 0:
+            csv.writer(f).writerow(header)
+        return csv.writer(f)
+
+    def write_record(self, kind, record):
+        fields = RECORD_FIELDS[kind]
+        writer = self._writer(f"{kind}.csv", fields)
+        record = dict(record, file=self.filename)
+        writer.writerow([_to_python(record.get(field)) for field in fields])
+
+    def write_grid(self, grid):
+        writer = self._writer(
+            "depth_grid.csv", ["file", "y"] + [str(x) for x in range(grid.shape[1])]
+        )
+        for y, row in enumerate(grid):
+            writer.writerow([self.filename, y] + [f"{value:.3f}" for value in row])
+
+
+class JSONLinesWriter(ExportWriter):
+    """All records in a single JSON Lines file; the depth grid is written
+    as one line per scanline."""
+
+    format_name = "jsonl"
+    output_name = "measurements.jsonl"
+
+    def owned_files(self):
+        return [self.output_name]
+
+    def _write(self, obj):
+        f = self._open(self.output_name)
+        f.write(json.dumps(obj) + "\n")
+
+    def write_record(self, kind, record):
+        obj = {field: _to_python(record.get(field)) for field in RECORD_FIELDS[kind]}
+        obj.update(kind=kind, file=self.filename)
+        self._write(obj)
+
+    def write_grid(self, grid):
+        for y, row in enumerate(grid):
+            self._write(
+                {
+                    "kind": "depth_grid",
+                    "file": self.filename,
+                    "y": y,
+                    "values": [round(float(value), 3) for value in row],
+                }
+            )
+
+
+class NPZWriter(ExportWriter):
+    """One compressed, columnar `.npz` file per portrait. Each column
+    is stored as a separate array named `<kind>/<field>`.
+
+    Archive names carry a short hash of the absolute path of the portrait,
+    as iPhone file names like IMG_0001.HEIC repeat across directories."""
+
+    format_name = "npz"
+
+    def begin_file(self, filename):
+        super().begin_file(filename)
+        self._columns = {}
+        self._grid = None
+
+    def write_record(self, kind, record):
+        for field in RECORD_FIELDS[kind]:
+            if field == "file":
+                continue
+            self._columns.setdefault(f"{kind}/{field}", []).append(
+                numpy.nan if record.get(field) is None else record.get(field)
+            )
+
+    def write_grid(self, grid):
+        self._grid = grid.astype(numpy.float32)
+
+    def portrait_output(self, filename):
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        digest = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return f"{stem}-{digest[:8]}.npz"
+
+    def end_file(self):
+        arrays = {name: numpy.asarray(values) for name, values in self._columns.items()}
+        if self._grid is not None:
+            arrays["depth_grid"] = self._grid
+
+        path = self.path(self.portrait_output(self.filename))
+        # Write to a temporary file first, so an interrupted export never
+        # leaves a half-written archive behind:
+        with open(path + ".tmp", "wb") as f:
+            numpy.savez_compressed(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+        self._columns = {}
+        self._grid = None
+        super().end_file()
+
+
+WRITERS = {
+    writer.format_name: writer for writer in [CSVWriter, JSONLinesWriter, NPZWriter]
+}
+
+
+class ExportSession:
+    """Output directory with a manifest of already exported portraits.
+
+    Raises `OutputExists` if the directory has output files but no manifest,
+    unless `overwrite` is True -- those files would be truncated."""
+
+    def __init__(self, directory, format_name, overwrite=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.writer = WRITERS[format_name](directory)
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.done = set()
+        self.outputs = {}
+
+        offsets = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r+b") as f:
+                committed = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Half-written last line of an interrupted export
+                        break
+                    entry = json.loads(line)
+                    self.done.add(entry["file"])
+                    if "output" in entry:
+                        self.outputs[entry["file"]] = entry["output"]
+                    offsets = entry["offsets"]
+                    committed += len(line)
+                f.truncate(committed)
+        else:
+            existing = [
+                name
+                for name in self.writer.owned_files()
+                if os.path.exists(self.writer.path(name))
+            ]
+            if existing and not overwrite:
+                raise OutputExists(
+                    f"{directory} already contains {', '.join(existing)}, "
+                    "not written by a resumable export"
+                )
+
+        self.offsets = offsets
+        self.writer.truncate(offsets)
+
+    def is_done(self, filename):
+        return os.path.abspath(filename) in self.done
+
+    def output_of(self, filename):
+        """Name of the file exported for this portrait only, if any"""
+        return self.outputs.get(os.path.abspath(filename))
+
+    def commit(self, filename, error=None):
+        entry = {
+            "file": os.path.abspath(filename),
+            "offsets": self.writer.offsets(),
+        }
+        if error is not None:
+            entry["error"] = error
+        else:
+            output = self.writer.portrait_output(filename)
+            if output is not None:
+                entry["output"] = output
+
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.done.add(entry["file"])
+        if "output" in entry:
+            self.outputs[entry["file"]] = entry["output"]
+        self.offsets = entry["offsets"]
+
+    def rollback(self):
+        """Drop anything written since the last commit"""
+        self.writer.close()
+        self.writer.truncate(self.offsets)
+
+    def export(self, filename, records, grid=None):
+        """Write an iterable of (kind, record) tuples and an optional
+        depth grid for a single portrait, then commit it."""
+        self.writer.begin_file(filename)
+        for kind, record in records:
+            self.writer.write_record(kind, record)
+        if grid is not None:
+            self.writer.write_grid(grid)
+        self.writer.end_file()
+        self.commit(filename)
+
+    def close(self):
+        self.writer.close()
+
+
+def portrait_records(
+    portrait, depth_cm, midline=None, clicks=(), ppm_model=None, coords=None
+):
+    """Generate (kind, record) tuples for a loaded portrait.
+
+    :param midline: (x, y, angle) of the midline, in depth map coordinates
+    :param clicks: iterable of already computed click measurements
+    :param ppm_model: `calibration.CalibrationModel` of the device
+    :param coords: `coordinates.CoordinateSystem` of the portrait, built
+        from the portrait if None
+    """
+    if coords is None:
+        coords = CoordinateSystem.for_portrait(portrait, depth_cm)
+
+    for record in clicks:
+        yield "click", record
+
+    if midline is not None:
+        raw = measurements.depthmap_to_array(portrait.depthmap)
+        xs, ys = measurements.midline_samples(*midline, depth_size=coords.depth_size)
+        raw_values = profiles.sample(raw, xs, ys)
+        depth_values = profiles.sample(depth_cm, xs, ys)
+        for index, (x, y, value, z) in enumerate(zip(xs, ys, raw_values, depth_values)):
+            yield "midline", {
+                "index": index,
+                "x": x,
+                "y": y,
+                "raw": value,
+                "depth_cm": z,
+            }
+
+        zs, lengths = measurements.surface_profile(
+            depth_cm, coords, xs, ys, calibration=ppm_model
+        )
+        for index, (x, y, z, length) in enumerate(zip(xs, ys, zs, lengths)):
+            yield "surface", {
+                "index": index,
+                "x": x,
+                "y": y,
+                "depth_cm": z,
+                "length_cm": length,
+            }
+
+    incisor = measurements.incisor_distance(portrait, depth_cm, coords, ppm_model)
+    if incisor is not None:
+        x1, y1, x2, y2, distance = incisor
+        yield "incisor", {
+            "x1": x1,
+            "y1": y1,
+            "x2": x2,
+            "y2": y2,
+            "distance_cm": distance,
+        }
+
+
+def default_midline(portrait, coords=None):
+    """Midline going through the center of the detected face, or through
+    the center of the image if no face was found"""
+    if coords is None:
+        coords = CoordinateSystem.for_portrait(portrait)
+    x, y = coords.depth_width // 2, coords.depth_height // 2
+    try:
+        face = detect_face(portrait.photo)
+    except Exception:
+        return x, y, 90
+
+    x, y = measurements.face_midline_point(face, coords)
+    return x, y, 90
+
+
+def find_portraits(directory, extensions=(".heic", ".heif")):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                yield os.path.join(root, name)
+
+
+def export_directory(
+    source,
+    output,
+    format_name,
+    depth_grid=True,
+    stream=sys.stderr,
+    overwrite=False,
+):
+    session = ExportSession(output, format_name, overwrite)
+    calibrations = calibration.load_calibrations()
+    try:
+        for filename in find_portraits(source):
+            if session.is_done(filename):
+                continue
+
+            try:
+                portrait = load_image(filename)
+                depth_cm = measurements.metric_depth_grid(
+                    portrait.depthmap, portrait.floatValueMin, portrait.floatValueMax
+                )
+                coords = CoordinateSystem.for_portrait(portrait, depth_cm)
+                session.export(
+                    filename,
+                    portrait_records(
+                        portrait,
+                        depth_cm,
+                        default_midline(portrait, coords),
+                        ppm_model=calibration.for_device(
+                            calibration.device_model_of_file(filename), calibrations
+                        ),
+                        coords=coords,
+                    ),
+                    depth_cm if depth_grid else None,
+                )
+            except Exception as e:
+                print(f"{filename}: {e}", file=stream)
+                traceback.print_exc(file=stream)
+                # Drop partial output of this file and remember the error,
+                # so the file is not retried when resuming:
+                session.rollback()
+                session.commit(filename, error=str(e))
+            else:
+                print(filename, file=stream)
+    finally:
+        session.close()
@@ -0,0 +1,174 @@
+"""Face detection on a downscaled copy of the photo.
+
+The face must take up a big part of the frame (see `const.MINIMUM_FACE_WIDTH_PERCENT`
+and `const.MINIMUM_FACE_HEIGHT_PERCENT`), so there is no need to run the cascade
+classifier over the full-resolution iPhone photo. The photo is reduced by a power of
+two, the face is detected there and its rectangle is scaled back to the full-resolution
+photo, so `translate_coordinates` and `calculate_percentage_of_image` work like before.
+
+Run as `python -m fidmaa_gui.face_detection DIRECTORY` to compare detection time
+and accuracy against the full-resolution path.
+"""
+
+import argparse
+import time
+
+from portrait_analyser.exceptions import MultipleFacesDetected, NoFacesDetected
+from portrait_analyser.face import Eye, Face, get_face_parameters
+from portrait_analyser.ios import load_image
+
+from . import const
+
+
+def pyramid_factor(size, max_size=const.FACE_DETECTION_MAX_SIZE):
+    """Smallest power of two that reduces the longer side of the image
+    to at most `max_size` pixels"""
+    factor = 1
+    while max(size) / factor > max_size:
+        factor *= 2
+    return factor
+
+
+class ScaledFace(Face):
+    """Face detected on a reduced image, with coordinates in the full-resolution one.
+
+    If `refine_eyes` is set, eyes are detected again on the full-resolution crop
+    of the face; otherwise eye rectangles found on the reduced image are scaled up.
+    """
+
+    def __init__(self, image, small_face, factor, refine_eyes):
+        self.small_face = small_face
+        self.factor = factor
+        self.refine_eyes = refine_eyes
+
+        super().__init__(image, *self.scale_rectangle(small_face))
+
+    def scale_rectangle(self, rect):
+        return [
+            int(round(value * self.factor))
+            for value in (rect.x, rect.y, rect.width, rect.height)
+        ]
+
+    def find_eyes(self):
+        if self.refine_eyes:
+            return super().find_eyes()
+
+        self.eyes = [
+            Eye(self, *self.scale_rectangle(eye)) for eye in self.small_face.eyes
+        ]
+
+
+def detect_face(
+    image,
+    max_size=const.FACE_DETECTION_MAX_SIZE,
+    refine_eyes=const.FACE_DETECTION_REFINE_EYES,
+    raise_opencv_exceptions=False,
+):
+    """Same as `portrait_analyser.face.get_face_parameters`, but runs the
+    detection on a downscaled copy of the image."""
+
+    factor = pyramid_factor(image.size, max_size)
+    if factor == 1:
+        return get_face_parameters(
+            image, raise_opencv_exceptions=raise_opencv_exceptions
+        )
+
+    small_face = get_face_parameters(
+        image.reduce(factor), raise_opencv_exceptions=raise_opencv_exceptions
+    )
+    return ScaledFace(image, small_face, factor, refine_eyes)
+
+
+def intersection_over_union(rect1, rect2):
+    x1, y1, w1, h1 = rect1.x, rect1.y, rect1.width, rect1.height
+    x2, y2, w2, h2 = rect2.x, rect2.y, rect2.width, rect2.height
+
+    wi = max(0, min(x1 + w1, x2 + w2) - max(x1, x2))
+    he = max(0, min(y1 + h1, y2 + h2) - max(y1, y2))
+    intersection = wi * he
+    union = w1 * h1 + w2 * h2 - intersection
+    if union == 0:
+        return 0.0
+    return intersection / union
+
+
+def _timed_detection(function, *args, **kw):
+    start = time.perf_counter()
+    try:
+        ret = function(*args, **kw)
+    except NoFacesDetected:
+        ret = "no face"
+    except MultipleFacesDetected:
+        ret = "multiple faces"
+    return ret, time.perf_counter() - start
+
+
+def benchmark(filenames, max_size=const.FACE_DETECTION_MAX_SIZE, iou_threshold=0.5):
+    """Compare face detection on a downscaled image with the full-resolution path.
+
+    :returns: list of dicts with per-file results
+    """
+    results = []
+    for filename in filenames:
+        image = load_image(filename).photo
+
+        full, full_time = _timed_detection(get_face_parameters, image)
+        fast, fast_time = _timed_detection(detect_face, image, max_size=max_size)
+
+        if isinstance(full, Face) and isinstance(fast, Face):
+            iou = intersection_over_union(full, fast)
+            agrees = iou >= iou_threshold
+        else:
+            iou = None
+            agrees = not isinstance(full, Face) and full == fast
+
+        results.append(
+            {
+                "file": filename,
+                "full_time": full_time,
+                "fast_time": fast_time,
+                "iou": iou,
+                "agrees": agrees,
+            }
+        )
+    return results
+
+
+def main():
+    from .export import find_portraits
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark face detection on a downscaled image"
+    )
+    parser.add_argument("directory", help="directory with HEIC files")
+    parser.add_argument("--max-size", type=int, default=const.FACE_DETECTION_MAX_SIZE)
+    args = parser.parse_args()
+
+    results = benchmark(find_portraits(args.directory), max_size=args.max_size)
+    for result in results:
+        iou = "-" if result["iou"] is None else f"{result['iou']:.3f}"
+        print(
+            f"{result['file']}: full {result['full_time']:.3f}s, "
+            f"fast {result['fast_time']:.3f}s, IoU {iou}, "
+            f"{'ok' if result['agrees'] else 'MISMATCH'}"
+        )
+
+    if not results:
+        return
+
+    full_time = sum(result["full_time"] for result in results)
+    fast_time = sum(result["fast_time"] for result in results)
+    ious = [result["iou"] for result in results if result["iou"] is not None]
+
+    print()
+    print(f"Files: {len(results)}")
+    print(f"Full resolution: {full_time / len(results):.3f}s per file")
+    print(f"Downscaled: {fast_time / len(results):.3f}s per file")
+    print(f"Speedup: {full_time / fast_time:.1f}x")
+    print(f"Accuracy: {sum(r['agrees'] for r in results) / len(results) * 100:.1f}%")
+    if ious:
+        print(f"Mean IoU: {sum(ious) / len(ious):.3f}")
+
+
+if __name__ == "__main__":
+    main()
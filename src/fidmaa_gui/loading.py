@@ -0,0 +1,164 @@
+"""Progressive loading of portraits.
+
+Opening a HEIC file used to decode the full-resolution photo, the depth map
+and the teeth map before anything could be shown. Here it happens in two steps:
+
+1. `load_depth_preview` parses the container, validates EXIF and decodes only
+   the small (480x640) depth map, its float range and the thumbnail stored
+   in the container -- enough to paint a low-resolution photo and take
+   measurements,
+2. `PortraitLoader` decodes the full portrait and detects the face in
+   a background thread and hands the result back to the GUI thread.
+
+Files without an embedded thumbnail show the depth map until the photo is ready.
+"""
+
+import xml.etree.ElementTree as ET
+
+import piexif
+import pyheif
+from portrait_analyser.exceptions import NoDepthMapFound, UnknownExtension
+from portrait_analyser.ios import check_exif_data, load_image
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+from .calibration import device_model
+from .face_detection import detect_face
+from .thumbnails import embedded_thumbnail, heif_to_pil
+
+PIXELDATAINFO_NS = "{http://ns.apple.com/pixeldatainfo/1.0/}"
+
+# Loaders being run. Each one is referenced here until it finishes, as the main
+# window drops its reference when another file is opened:
+_running_loaders = set()
+
+
+class DepthPreview:
+    def __init__(
+        self,
+        filename,
+        depthmap,
+        photo_size,
+        floatValueMin=None,
+        floatValueMax=None,
+        device_model=None,
+        thumbnail=None,
+    ):
+        self.filename = filename
+        self.depthmap = depthmap
+        # Size of the full-resolution photo, as declared in the container:
+        self.photo_size = photo_size
+        self.floatValueMin = floatValueMin
+        self.floatValueMax = floatValueMax
+        # EXIF model of the device, used to pick its calibration:
+        self.device_model = device_model
+        # Low-resolution photo embedded in the container, if any:
+        self.thumbnail = thumbnail
+
+
+def depth_float_range(depth_image):
+    """Float min/max values from the XML metadata of the depth image"""
+    values = {}
+    for metadata in depth_image.metadata or []:
+        if metadata.get("type", "") == "mime":
+            root = ET.fromstring(metadata.get("data"))
+            for elem in root[0][0]:
+                values[elem.tag] = elem.text
+
+    float_min = values.get(PIXELDATAINFO_NS + "FloatMinValue")
+    float_max = values.get(PIXELDATAINFO_NS + "FloatMaxValue")
+    return (
+        float(float_min) if float_min is not None else None,
+        float(float_max) if float_max is not None else None,
+    )
+
+
+def load_depth_preview(fileName, with_thumbnail=False):
+    """Validate the file and decode only its depth map and, if
+    `with_thumbnail`, the thumbnail embedded in the container.
+
+    Raises the same exceptions as `portrait_analyser.ios.load_image`.
+    """
+    if not fileName.lower().endswith(("heic", "heif")):
+        raise UnknownExtension(
+            "only supported extensions for filenames are: HEIF, HEIC"
+        )
+
+    with open(fileName, "rb") as f:
+        heif_container = pyheif.open_container(f)
+
+    primary_image = heif_container.primary_image
+
+    # Metadata is available without decoding the photo:
+    model = None
+    for metadata in primary_image.image.metadata or []:
+        if metadata.get("type", "") == "Exif":
+            exif = piexif.load(metadata["data"])
+            check_exif_data(exif)
+            model = device_model(exif)
+
+    if primary_image.depth_image is None:
+        raise NoDepthMapFound(f"{fileName} has no depth data")
+
+    depth_loaded = primary_image.depth_image.image.load()
+    float_min, float_max = depth_float_range(depth_loaded)
+
+    thumbnail = None
+    if with_thumbnail:
+        # The smallest one that is at least as big as the depth map:
+        undecoded = embedded_thumbnail(primary_image, depth_loaded.size)
+        if undecoded is not None:
+            thumbnail = heif_to_pil(undecoded.load()).convert("RGB")
+
+    return DepthPreview(
+        fileName,
+        heif_to_pil(depth_loaded),
+        primary_image.image.size,
+        float_min,
+        float_max,
+        model,
+        thumbnail,
+    )
+
+
+class PortraitLoaderSignals(QObject):
+    # filename, portrait, face or the exception raised by face detection
+    loaded = Signal(str, object, object)
+    # filename, exception
+    failed = Signal(str, object)
+
+
+def _loader_done(loader):
+    _running_loaders.discard(loader)
+
+
+class PortraitLoader(QRunnable):
+    """Decode the full portrait and detect the face in a background thread.
+    Connect to `signals`, then call `start`."""
+
+    def __init__(self, fileName):
+        super().__init__()
+        self.fileName = fileName
+        self.signals = PortraitLoaderSignals()
+        # Referenced from Python until it finishes, see `start`:
+        self.setAutoDelete(False)
+
+    def start(self, pool=None):
+        """Run in `pool`, the global thread pool by default"""
+        self.signals.loaded.connect(lambda *args: _loader_done(self))
+        self.signals.failed.connect(lambda *args: _loader_done(self))
+        _running_loaders.add(self)
+        (pool or QThreadPool.globalInstance()).start(self)
+
+    def run(self):
+        try:
+            portrait = load_image(self.fileName)
+        except Exception as e:
+            self.signals.failed.emit(self.fileName, e)
+            return
+
+        try:
+            face = detect_face(portrait.photo, raise_opencv_exceptions=True)
+        except Exception as e:
+            face = e
+
+        self.signals.loaded.emit(self.fileName, portrait, face)
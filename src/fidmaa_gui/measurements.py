@@ -0,0 +1,278 @@
+"""Measurements computed from a loaded portrait, without the GUI.
+
+All the coordinates here are in the depth map space (480x640), just like
+the coordinates of the clicks in the main window. Conversions to the photo
+space go through the `coordinates.CoordinateSystem` of the portrait.
+"""
+
+import math
+
+import numpy
+
+from . import calculations, profiles
+from .calculations import findPoint
+
+
+def depthmap_to_array(depthmap):
+    """Raw (0-255) values of the depth map as a 2D array"""
+    ret = numpy.asarray(depthmap)
+    if ret.ndim == 3:
+        ret = ret[..., 0]
+    return ret
+
+
+def raw_to_cm(raw, float_min_value, float_max_value):
+    """Raw (0-255) depth map values converted to distances in centimeters.
+
+    If the portrait has no float range in its metadata, raw values are returned.
+    """
+    if float_min_value is None or float_max_value is None:
+        return raw
+    return calculations.depthmap_value_to_distance(
+        raw, float_min_value, float_max_value
+    )
+
+
+def metric_depth_grid(depthmap, float_min_value, float_max_value):
+    """Depth map converted to distances in centimeters, see `raw_to_cm`"""
+    raw = depthmap_to_array(depthmap).astype(numpy.float64)
+    return raw_to_cm(raw, float_min_value, float_max_value)
+
+
+def pixels_to_mm(distance_cm, no_pixels, calibration=None):
+    """Array version of `how_many_mm_per_pixels_at_distance_on_big_image`"""
+    return calculations.how_many_mm_per_pixels_at_distance_on_big_image(
+        numpy.asarray(distance_cm), no_pixels, calibration
+    )
+
+
+def metric_points(depth_cm, coords, z_scale=1.0, calibration=None):
+    """Metric position of every pixel of the depth grid: x and y in milimeters
+    from the camera axis, z in centimeters multiplied by `z_scale`.
+
+    :param coords: `coordinates.CoordinateSystem` of the portrait
+    """
+    xs, ys = coords.photo_grid()
+    return numpy.stack(
+        [
+            pixels_to_mm(depth_cm, xs, calibration),
+            pixels_to_mm(depth_cm, ys, calibration),
+            depth_cm * z_scale,
+        ],
+        axis=-1,
+    )
+
+
+def midline_samples(x, y, angle, density=1.0, *, depth_size):
+    """Coordinates of samples along the midline crossing (x, y) at a given
+    angle, top to bottom"""
+    width, height = depth_size
+    p1 = findPoint(x, y, direction=-1, maxWidth=width, maxHeight=height, angle=angle)
+    p2 = findPoint(x, y, direction=1, maxWidth=width, maxHeight=height, angle=angle)
+
+    point_beg = p2
+    point_end = p1
+
+    if p1.y() < p2.y():
+        point_beg = p1
+        point_end = p2
+
+    return profiles.line_samples(point_beg.x(), 0, point_end.x(), height - 1, density)
+
+
+def face_midline_point(face, coords):
+    """Depth map point the default midline goes through: the center of
+    the face, a bit lower, nearer to the teeth"""
+    return coords.photo_to_depth_pixel(face.center_x, face.center_y + face.height / 4)
+
+
+def surface_profile(
+    depth_cm, coords, xs, ys, interpolation=profiles.BILINEAR, calibration=None
+):
+    """Cumulative length measured over the surface of 3D data along given
+    (possibly fractional) coordinates.
+
+    :param depth_cm: metric depth grid, see `metric_depth_grid`
+    :param coords: `coordinates.CoordinateSystem` of the portrait
+    :returns: (depths in cm, cumulative surface length in cm)
+    """
+    zs = profiles.sample(depth_cm, xs, ys, interpolation)
+    mm_x, mm_y = coords.to_mm(zs, xs, ys, calibration)
+
+    steps = numpy.sqrt(
+        numpy.diff(mm_x) ** 2 + numpy.diff(mm_y) ** 2 + numpy.diff(zs) ** 2
+    )
+    return zs, numpy.concatenate([[0.0], numpy.cumsum(steps)]) / 10.0
+
+
+def surface_length(
+    depth_cm,
+    coords,
+    x1,
+    y1,
+    x2,
+    y2,
+    density=1.0,
+    interpolation=profiles.BILINEAR,
+    calibration=None,
+):
+    """Length measured over the surface of 3D data from (x1, y1) to (x2, y2), in cm"""
+    xs, ys = profiles.line_samples(x1, y1, x2, y2, density)
+    _, lengths = surface_profile(depth_cm, coords, xs, ys, interpolation, calibration)
+    return float(lengths[-1])
+
+
+def incisor_line(portrait, coords):
+    """Vertical line between the upper and lower edge of the teeth bounding box.
+
+    :returns: (x, y1, y2) or None if no teeth were found
+    """
+    if portrait is None or portrait.teeth_bbox is None:
+        return
+
+    smx, smy, smwi, smhe = portrait.teeth_bbox_translated(*coords.depth_size)
+    smy += 3
+    smhe -= 6
+    return smx + smwi / 2, smy, smy + smhe
+
+
+def incisor_distance(portrait, depth_cm, coords, calibration=None):
+    """Distance between the upper and lower edge of the teeth bounding box.
+
+    :returns: (x1, y1, x2, y2, distance in cm) or None if no teeth were found
+    """
+    line = incisor_line(portrait, coords)
+    if line is None:
+        return
+    x, y1, y2 = line
+
+    z1 = depth_cm[int(y1), int(x)]
+    z2 = depth_cm[int(y2), int(x)]
+
+    x1_mm, y1_mm = coords.to_mm(z1, x, y1, calibration)
+    x2_mm, y2_mm = coords.to_mm(z2, x, y2, calibration)
+
+    return (
+        x,
+        y1,
+        x,
+        y2,
+        calculations.vector_length_simple(x1_mm, y1_mm, z1, x2_mm, y2_mm, z2) / 10.0,
+    )
+
+
+def point_pair(
+    depth_raw,
+    depth_cm,
+    coords,
+    x1,
+    y1,
+    x2,
+    y2,
+    calibration=None,
+    density=1.0,
+    interpolation=profiles.BILINEAR,
+):
+    """Measurements between two points, like those shown after clicking
+    twice in the main window.
+
+    `angle_deg` is the angle between the line and the camera axis, None if
+    the points are the same. `calibrated` is False if any of the points lies
+    outside of the distance range of the calibration, so that its pixel/mm
+    scale was clamped.
+    """
+    if calibration is None:
+        calibration = calculations.DEFAULT_CALIBRATION
+    z1, z2 = depth_cm[y1, x1], depth_cm[y2, x2]
+
+    x1_mm, y1_mm = coords.to_mm(z1, x1, y1, calibration)
+    x2_mm, y2_mm = coords.to_mm(z2, x2, y2, calibration)
+    vector_length_3d = calculations.vector_length_simple(
+        x1_mm, y1_mm, z1, x2_mm, y2_mm, z2
+    )
+
+    angle_deg = None
+    if vector_length_3d > 0.0:
+        cosine = abs((z1 - z2) / (vector_length_3d / 10.0))
+        if cosine <= 1.0:
+            angle_deg = math.degrees(math.acos(cosine))
+
+    return {
+        "x1": x1,
+        "y1": y1,
+        "x2": x2,
+        "y2": y2,
+        "depth_cm": float(z2),
+        "line_length_px": calculations.calculate_line_length(x2 - x1, y2 - y1),
+        "vector_length_voxels": calculations.vector_length_simple(
+            x1, y1, int(depth_raw[y1, x1]), x2, y2, int(depth_raw[y2, x2])
+        ),
+        "vector_length_3d_cm": vector_length_3d / 10.0,
+        "surface_length_cm": surface_length(
+            depth_cm, coords, x1, y1, x2, y2, density, interpolation, calibration
+        ),
+        "angle_deg": angle_deg,
+        "calibrated": bool(calibration.in_range([z1, z2]).all()),
+    }
+
+
+class RubberBand:
+    """Straight and surface length from an anchor to any other point,
+    updated while the mouse moves.
+
+    Metric positions of all pixels are computed once per portrait and
+    lengths are remembered per anchor, as the mouse often comes back over
+    the same pixels. Units are the same as in the main window: x and y in mm,
+    z in cm, results divided by 10.
+    """
+
+    MAX_REMEMBERED = 10000
+
+    def __init__(
+        self,
+        depth_cm,
+        coords,
+        density=1.0,
+        interpolation=profiles.BILINEAR,
+        calibration=None,
+    ):
+        self.depth_cm = depth_cm
+        self.coords = coords
+        self.density = density
+        self.interpolation = interpolation
+        self.calibration = calibration
+        self.points = metric_points(depth_cm, coords, calibration=calibration)
+        self.anchor = None
+        self._lengths = {}
+
+    def set_anchor(self, x, y):
+        if (x, y) != self.anchor:
+            self.anchor = (x, y)
+            self._lengths = {}
+
+    def measure(self, x, y):
+        """:returns: (straight 3D length, surface length) in cm"""
+        if (x, y) in self._lengths:
+            return self._lengths[(x, y)]
+
+        anchor_x, anchor_y = self.anchor
+        straight = numpy.linalg.norm(
+            self.points[y, x] - self.points[anchor_y, anchor_x]
+        )
+
+        surface = surface_length(
+            self.depth_cm,
+            self.coords,
+            anchor_x,
+            anchor_y,
+            x,
+            y,
+            self.density,
+            self.interpolation,
+            self.calibration,
+        )
+
+        if len(self._lengths) >= self.MAX_REMEMBERED:
+            self._lengths = {}
+        ret = self._lengths[(x, y)] = (straight / 10.0, surface)
+        return ret
@@ -0,0 +1,378 @@
+"""Closed 3D meshes of the face, for 3D printing.
+
+The metric depth grid becomes the front surface of a solid: the boundary of
+the surface is extruded backwards into straight walls and the back is closed
+with a flat cap, so the mesh is watertight. Coordinates are in milimeters,
+X to the right, Y up and Z towards the viewer.
+
+The grid can be resampled with `scale`: below 1.0 the mesh is decimated,
+above 1.0 the depth grid is bilinearly upsampled, up to the resolution of
+the photo. Vertices and faces are generated with NumPy, band of rows after
+band of rows, and written straight to the file, so memory use depends on
+the band size only, not on the size of the mesh.
+
+Run as `python -m fidmaa_gui.mesh FILE OUTPUT.{ply,stl,obj} [--scale S]`.
+"""
+
+import argparse
+import os
+import struct
+
+import numpy
+
+from . import measurements, profiles
+from .coordinates import CoordinateSystem
+
+FORMATS = (".ply", ".stl", ".obj")
+
+DEFAULT_THICKNESS_MM = 5.0
+
+# How many vertices are generated at once
+BAND_VERTICES = 1 << 16
+
+# Appended to the stem of the mesh file for the files written next to it, so
+# they do not replace the photo (IMG_0001.jpg next to IMG_0001.HEIC):
+TEXTURE_SUFFIX = "_texture.jpg"
+MATERIAL_SUFFIX = "_material.mtl"
+
+
+class MeshGrid:
+    """Vertices and faces of a closed mesh built from a depth grid.
+
+    Vertex indices: the front surface first, row by row, then the back copy
+    of its boundary and the center of the back cap.
+
+    :param depth_cm: metric depth grid, see `measurements.metric_depth_grid`
+    :param coords: `coordinates.CoordinateSystem` of the portrait
+    :param scale: resampling of the grid, 1.0 keeps one vertex per depth pixel
+    :param thickness_mm: distance from the farthest point of the surface
+        to the back cap
+    """
+
+    def __init__(
+        self,
+        depth_cm,
+        coords,
+        scale=1.0,
+        thickness_mm=DEFAULT_THICKNESS_MM,
+        calibration=None,
+        band_vertices=BAND_VERTICES,
+    ):
+        height, width = depth_cm.shape
+        self.depth_cm = depth_cm
+        self.coords = coords
+        self.calibration = calibration
+
+        self.cols = max(2, int(round((width - 1) * scale)) + 1)
+        self.rows = max(2, int(round((height - 1) * scale)) + 1)
+        # Depth map coordinates of the grid columns and rows:
+        self.xs = numpy.linspace(0, width - 1, self.cols)
+        self.ys = numpy.linspace(0, height - 1, self.rows)
+
+        # Bilinear interpolation never goes past the farthest pixel:
+        self.back_z = -float(depth_cm.max()) * 10.0 - thickness_mm
+        self.band_rows = max(1, band_vertices // self.cols)
+
+        self.front_count = self.rows * self.cols
+        self.ring = self._ring()
+
+    @property
+    def vertex_count(self):
+        return self.front_count + len(self.ring) + 1
+
+    @property
+    def face_count(self):
+        return 2 * (self.rows - 1) * (self.cols - 1) + 3 * len(self.ring)
+
+    def _ring(self):
+        """Indices of the front vertices along the boundary of the grid"""
+        rows, cols = self.rows, self.cols
+        top = numpy.arange(cols)
+        right = numpy.arange(1, rows) * cols + cols - 1
+        bottom = (rows - 1) * cols + numpy.arange(cols - 2, -1, -1)
+        left = numpy.arange(rows - 2, 0, -1) * cols
+        return numpy.concatenate([top, right, bottom, left])
+
+    def vertices(self, indices):
+        """Positions (float32, mm) and texture coordinates of front vertices"""
+        rows, cols = numpy.divmod(indices, self.cols)
+        xs = self.xs[cols]
+        ys = self.ys[rows]
+
+        z_cm = profiles.sample(self.depth_cm, xs, ys)
+        positions = numpy.empty((len(indices), 3), dtype=numpy.float32)
+        mm_x, mm_y = self.coords.to_mm(z_cm, xs, ys, self.calibration)
+        positions[:, 0] = mm_x
+        positions[:, 1] = -mm_y
+        positions[:, 2] = -z_cm * 10.0
+
+        uv = numpy.empty((len(indices), 2), dtype=numpy.float32)
+        uv[:, 0] = xs / (self.depth_cm.shape[1] - 1)
+        uv[:, 1] = 1.0 - ys / (self.depth_cm.shape[0] - 1)
+        return positions, uv
+
+    def bands(self):
+        """Ranges of front rows, [first, last)"""
+        for first in range(0, self.rows, self.band_rows):
+            yield first, min(first + self.band_rows, self.rows)
+
+    def front_faces(self, first, last):
+        """Triangles of the quads starting in rows [first, last)"""
+        last = min(last, self.rows - 1)
+        rows = numpy.arange(first, last)
+        cols = numpy.arange(self.cols - 1)
+        v00 = (rows[:, None] * self.cols + cols[None, :]).ravel()
+        v01 = v00 + 1
+        v10 = v00 + self.cols
+        v11 = v10 + 1
+
+        ret = numpy.empty((len(v00), 2, 3), dtype=numpy.int32)
+        ret[:, 0] = numpy.column_stack([v00, v10, v01])
+        ret[:, 1] = numpy.column_stack([v01, v10, v11])
+        return ret.reshape(-1, 3)
+
+    def closing_vertices(self):
+        """Positions and texture coordinates of the vertices after the front
+        surface: the back copy of the boundary and the center of the back"""
+        ring_positions, ring_uv = self.vertices(self.ring)
+
+        back = ring_positions.copy()
+        back[:, 2] = self.back_z
+        center = back.mean(axis=0, keepdims=True)
+
+        return (
+            numpy.concatenate([back, center]),
+            numpy.concatenate([ring_uv, [[0.5, 0.5]]]).astype(numpy.float32),
+        )
+
+    def closing_faces(self):
+        """Triangles of the walls and of the back cap, using indices local to
+        (front boundary, back boundary, back center)"""
+        count = len(self.ring)
+        a = numpy.arange(count)
+        b = (a + 1) % count
+        back_a = a + count
+        back_b = b + count
+        center = numpy.full(count, 2 * count)
+
+        return numpy.concatenate(
+            [
+                numpy.column_stack([a, b, back_b]),
+                numpy.column_stack([a, back_b, back_a]),
+                numpy.column_stack([back_a, back_b, center]),
+            ]
+        ).astype(numpy.int32)
+
+    def closing_faces_global(self):
+        """`closing_faces` with indices of the whole mesh"""
+        lookup = numpy.concatenate(
+            [
+                self.ring,
+                self.front_count + numpy.arange(len(self.ring) + 1),
+            ]
+        )
+        return lookup[self.closing_faces()]
+
+    def front_vertex_bands(self):
+        """Positions and texture coordinates of the front surface, by bands"""
+        for first, last in self.bands():
+            yield self.vertices(
+                numpy.arange(first * self.cols, last * self.cols, dtype=numpy.int64)
+            )
+
+
+#
+# Writers
+#
+
+
+def write_ply(fileName, mesh, texture_name=None):
+    """Binary little-endian PLY with per-vertex texture coordinates"""
+    header = ["ply", "format binary_little_endian 1.0"]
+    if texture_name:
+        header.append(f"comment TextureFile {texture_name}")
+    header += [
+        f"element vertex {mesh.vertex_count}",
+        "property float x",
+        "property float y",
+        "property float z",
+        "property float s",
+        "property float t",
+        f"element face {mesh.face_count}",
+        "property list uchar int vertex_indices",
+        "end_header",
+    ]
+
+    vertex_dtype = numpy.dtype([("position", "<f4", 3), ("uv", "<f4", 2)])
+    face_dtype = numpy.dtype([("count", "u1"), ("indices", "<i4", 3)])
+
+    def vertex_records(positions, uv):
+        ret = numpy.empty(len(positions), dtype=vertex_dtype)
+        ret["position"] = positions
+        ret["uv"] = uv
+        return ret
+
+    def face_records(faces):
+        ret = numpy.empty(len(faces), dtype=face_dtype)
+        ret["count"] = 3
+        ret["indices"] = faces
+        return ret
+
+    with open(fileName, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+
+        for positions, uv in mesh.front_vertex_bands():
+            vertex_records(positions, uv).tofile(f)
+        vertex_records(*mesh.closing_vertices()).tofile(f)
+
+        for first, last in mesh.bands():
+            face_records(mesh.front_faces(first, last)).tofile(f)
+        face_records(mesh.closing_faces_global()).tofile(f)
+
+
+def _stl_triangles(f, triangles):
+    """Write triangles given as an (n, 3, 3) array of positions"""
+    normals = numpy.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    lengths = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    normals /= numpy.where(lengths > 0, lengths, 1.0)
+
+    records = numpy.zeros(
+        len(triangles),
+        dtype=numpy.dtype(
+            [("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")]
+        ),
+    )
+    records["normal"] = normals
+    records["vertices"] = triangles
+    records.tofile(f)
+
+
+def write_stl(fileName, mesh):
+    """Binary STL; it has no texture coordinates"""
+    with open(fileName, "wb") as f:
+        f.write(b"FIDMAA face mesh".ljust(80, b"\0"))
+        f.write(struct.pack("<I", mesh.face_count))
+
+        for first, last in mesh.bands():
+            faces = mesh.front_faces(first, last)
+            if not len(faces):
+                continue
+            # Quads of these rows also use the first row of the next band:
+            offset = first * mesh.cols
+            positions, _ = mesh.vertices(
+                numpy.arange(offset, (min(last, mesh.rows - 1) + 1) * mesh.cols)
+            )
+            _stl_triangles(f, positions[faces - offset])
+
+        ring_positions, _ = mesh.vertices(mesh.ring)
+        closing_positions, _ = mesh.closing_vertices()
+        positions = numpy.concatenate([ring_positions, closing_positions])
+        _stl_triangles(f, positions[mesh.closing_faces()])
+
+
+def write_obj(fileName, mesh, texture_name=None):
+    """Wavefront OBJ, with a material using the photo as a texture"""
+    stem = os.path.splitext(os.path.basename(fileName))[0]
+
+    with open(fileName, "w", encoding="ascii") as f:
+        f.write("# FIDMAA face mesh\n")
+        if texture_name:
+            mtl_name = stem + MATERIAL_SUFFIX
+            with open(
+                os.path.join(os.path.dirname(fileName), mtl_name), "w", encoding="ascii"
+            ) as mtl:
+                mtl.write(f"newmtl face\nKd 1 1 1\nmap_Kd {texture_name}\n")
+            f.write(f"mtllib {mtl_name}\nusemtl face\n")
+
+        for positions, uv in mesh.front_vertex_bands():
+            numpy.savetxt(f, positions, fmt="v %.4f %.4f %.4f")
+            numpy.savetxt(f, uv, fmt="vt %.6f %.6f")
+        positions, uv = mesh.closing_vertices()
+        numpy.savetxt(f, positions, fmt="v %.4f %.4f %.4f")
+        numpy.savetxt(f, uv, fmt="vt %.6f %.6f")
+
+        # Every vertex has its own texture coordinate with the same index:
+        def write_faces(faces):
+            faces = numpy.repeat(faces + 1, 2, axis=1)
+            numpy.savetxt(f, faces, fmt="f %d/%d %d/%d %d/%d")
+
+        for first, last in mesh.bands():
+            write_faces(mesh.front_faces(first, last))
+        write_faces(mesh.closing_faces_global())
+
+
+def export_mesh(
+    fileName,
+    depth_cm,
+    coords,
+    photo=None,
+    scale=1.0,
+    thickness_mm=DEFAULT_THICKNESS_MM,
+    calibration=None,
+):
+    """Write a closed mesh to a PLY, STL or OBJ file, chosen by the extension.
+
+    For PLY and OBJ, the photo is saved next to the mesh as its texture,
+    named with `TEXTURE_SUFFIX`.
+    """
+    extension = os.path.splitext(fileName)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported mesh format {extension!r}, use one of {FORMATS}")
+
+    mesh = MeshGrid(depth_cm, coords, scale, thickness_mm, calibration)
+
+    texture_name = None
+    if photo is not None and extension != ".stl":
+        texture_name = os.path.splitext(os.path.basename(fileName))[0] + TEXTURE_SUFFIX
+        photo.convert("RGB").save(
+            os.path.join(os.path.dirname(fileName), texture_name), quality=90
+        )
+
+    if extension == ".ply":
+        write_ply(fileName, mesh, texture_name)
+    elif extension == ".stl":
+        write_stl(fileName, mesh)
+    else:
+        write_obj(fileName, mesh, texture_name)
+    return mesh
+
+
+def main():
+    from portrait_analyser.ios import load_image
+
+    from . import calibration
+
+    parser = argparse.ArgumentParser(
+        description="Export a closed 3D mesh of a portrait for 3D printing"
+    )
+    parser.add_argument("file", help="HEIC file")
+    parser.add_argument("output", help="output file, .ply, .stl or .obj")
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="resampling of the depth grid; below 1 decimates, above 1 upsamples",
+    )
+    parser.add_argument("--thickness", type=float, default=DEFAULT_THICKNESS_MM)
+    args = parser.parse_args()
+
+    portrait = load_image(args.file)
+    depth_cm = measurements.metric_depth_grid(
+        portrait.depthmap, portrait.floatValueMin, portrait.floatValueMax
+    )
+    mesh = export_mesh(
+        args.output,
+        depth_cm,
+        CoordinateSystem.for_portrait(portrait, depth_cm),
+        portrait.photo,
+        args.scale,
+        args.thickness,
+        calibration.for_device(calibration.device_model_of_file(args.file)),
+    )
+    print(f"{args.output}: {mesh.vertex_count} vertices, {mesh.face_count} faces")
+
+
+if __name__ == "__main__":
+    main()
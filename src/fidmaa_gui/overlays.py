@@ -0,0 +1,74 @@
+"""Overlays painted over the photo in the main window.
+
+Overlays are computed once per portrait and per setting and cached as pixmaps.
+The main window shows them in transparent labels stacked over `imageLabel`, so
+turning them on and off does not cost anything when repainting the photo.
+"""
+
+import cv2
+import numpy
+from PySide6.QtGui import QPixmap
+
+from .display import DisplayBuffer
+
+
+def depth_colormap(depth_raw, colormap=cv2.COLORMAP_JET, alpha=128):
+    """False-colour RGBA image of the raw (0-255) depth map"""
+    colored = cv2.applyColorMap(depth_raw, colormap)
+    rgba = cv2.cvtColor(colored, cv2.COLOR_BGR2RGBA)
+    rgba[..., 3] = alpha
+    return rgba
+
+
+def iso_depth_contours(depth_cm, step_mm, color=(255, 255, 255, 255), smoothing=5):
+    """RGBA image with lines separating areas every `step_mm` milimeters of depth"""
+    depth_mm = cv2.medianBlur(depth_cm.astype(numpy.float32), smoothing) * 10.0
+    levels = numpy.floor(depth_mm / step_mm).astype(numpy.int32)
+
+    lines = numpy.zeros(levels.shape, dtype=bool)
+    lines[:, :-1] |= levels[:, :-1] != levels[:, 1:]
+    lines[:-1, :] |= levels[:-1, :] != levels[1:, :]
+
+    rgba = numpy.zeros(levels.shape + (4,), dtype=numpy.uint8)
+    rgba[lines] = color
+    return rgba
+
+
+class OverlayCache:
+    """Pixmaps of overlays for a single portrait, keyed by their settings.
+
+    :param size: size of the pixmaps in device pixels, see
+        `coordinates.CoordinateSystem.device_size`
+    """
+
+    def __init__(self, depth_raw, depth_cm, size=(480, 640), device_pixel_ratio=1.0):
+        self.depth_raw = depth_raw
+        self.depth_cm = depth_cm
+        self.size = size
+        self.device_pixel_ratio = device_pixel_ratio
+        self._pixmaps = {}
+
+    def _pixmap(self, key, function, *args):
+        if key not in self._pixmaps:
+            array = function(*args)
+            if (array.shape[1], array.shape[0]) != self.size:
+                array = cv2.resize(array, self.size, interpolation=cv2.INTER_NEAREST)
+            # QPixmap.fromImage copies the data, so the buffer can go away:
+            pixmap = QPixmap.fromImage(DisplayBuffer(array).qimage)
+            pixmap.setDevicePixelRatio(self.device_pixel_ratio)
+            self._pixmaps[key] = pixmap
+        return self._pixmaps[key]
+
+    def depth_colormap(self, colormap=cv2.COLORMAP_JET, alpha=128):
+        return self._pixmap(
+            ("colormap", colormap, alpha),
+            depth_colormap,
+            self.depth_raw,
+            colormap,
+            alpha,
+        )
+
+    def contours(self, step_mm):
+        return self._pixmap(
+            ("contours", step_mm), iso_depth_contours, self.depth_cm, step_mm
+        )
@@ -0,0 +1,120 @@
+"""Profiles of the depth map sampled along lines, with sub-pixel precision.
+
+Points along a line have fractional coordinates, but reading them with
+`getpixel` truncates them to whole pixels, which gives staircase profiles
+and surface lengths jumping when the angle of the line changes slightly. Here
+the grid is interpolated at the fractional coordinates, for all the samples
+at once.
+"""
+
+import math
+
+import numpy
+
+NEAREST = "nearest"
+BILINEAR = "bilinear"
+BICUBIC = "bicubic"
+
+INTERPOLATIONS = (NEAREST, BILINEAR, BICUBIC)
+
+
+def line_samples(x1, y1, x2, y2, density=1.0):
+    """Coordinates of evenly spaced samples from (x1, y1) to (x2, y2), both ends
+    included.
+
+    :param density: samples per pixel along the longer axis of the line; with 1.0
+        there is one sample per whole pixel step
+    """
+    steps = int(math.ceil(max(abs(x2 - x1), abs(y2 - y1)) * density))
+    if steps == 0:
+        return numpy.array([float(x1)]), numpy.array([float(y1)])
+
+    t = numpy.linspace(0.0, 1.0, steps + 1)
+    return x1 + (x2 - x1) * t, y1 + (y2 - y1) * t
+
+
+def _nearest(grid, xs, ys):
+    # Truncate, like `getpixel` does with fractional coordinates:
+    height, width = grid.shape
+    xs = numpy.clip(xs, 0, width - 1).astype(int)
+    ys = numpy.clip(ys, 0, height - 1).astype(int)
+    return grid[ys, xs].astype(numpy.float64)
+
+
+def _bilinear(grid, xs, ys):
+    height, width = grid.shape
+    xs = numpy.clip(xs, 0, width - 1)
+    ys = numpy.clip(ys, 0, height - 1)
+
+    x0 = numpy.minimum(xs.astype(int), width - 2)
+    y0 = numpy.minimum(ys.astype(int), height - 2)
+    fx = xs - x0
+    fy = ys - y0
+
+    grid = grid.astype(numpy.float64, copy=False)
+    top = grid[y0, x0] * (1 - fx) + grid[y0, x0 + 1] * fx
+    bottom = grid[y0 + 1, x0] * (1 - fx) + grid[y0 + 1, x0 + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def _cubic_weights(t, a=-0.5):
+    """Weights of the samples at offsets -1, 0, 1 and 2 (Keys cubic kernel)"""
+    t2 = t * t
+    t3 = t2 * t
+    return (
+        a * (t3 - 2 * t2 + t),
+        (a + 2) * t3 - (a + 3) * t2 + 1,
+        -(a + 2) * t3 + (2 * a + 3) * t2 - a * t,
+        a * (t2 - t3),
+    )
+
+
+def _bicubic(grid, xs, ys):
+    height, width = grid.shape
+    xs = numpy.clip(xs, 0, width - 1)
+    ys = numpy.clip(ys, 0, height - 1)
+
+    x0 = numpy.floor(xs).astype(int)
+    y0 = numpy.floor(ys).astype(int)
+    weights_x = _cubic_weights(xs - x0)
+    weights_y = _cubic_weights(ys - y0)
+
+    grid = grid.astype(numpy.float64, copy=False)
+    ret = numpy.zeros(xs.shape, dtype=numpy.float64)
+    for j, weight_y in enumerate(weights_y):
+        rows = numpy.clip(y0 + j - 1, 0, height - 1)
+        for i, weight_x in enumerate(weights_x):
+            columns = numpy.clip(x0 + i - 1, 0, width - 1)
+            ret += grid[rows, columns] * weight_x * weight_y
+    return ret
+
+
+SAMPLERS = {
+    NEAREST: _nearest,
+    BILINEAR: _bilinear,
+    BICUBIC: _bicubic,
+}
+
+
+def sample(grid, xs, ys, interpolation=BILINEAR):
+    """Values of a 2D grid at fractional coordinates.
+
+    Coordinates outside of the grid are moved to its edge.
+    """
+    try:
+        sampler = SAMPLERS[interpolation]
+    except KeyError:
+        raise ValueError(f"Unknown interpolation {interpolation!r}")
+
+    xs = numpy.asarray(xs, dtype=numpy.float64)
+    ys = numpy.asarray(ys, dtype=numpy.float64)
+    return sampler(grid, xs, ys)
+
+
+def line_profile(grid, x1, y1, x2, y2, density=1.0, interpolation=BILINEAR):
+    """Values of a 2D grid along a line.
+
+    :returns: (x coordinates, y coordinates, values)
+    """
+    xs, ys = line_samples(x1, y1, x2, y2, density)
+    return xs, ys, sample(grid, xs, ys, interpolation)
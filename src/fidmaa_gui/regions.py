@@ -0,0 +1,133 @@
+"""Surface area and volume of a region drawn as a polygon over the depth map.
+
+`RegionEngine` precomputes, once per portrait, the metric position of every
+depth map pixel, the area of the surface between neighbouring pixels and the
+footprint of every pixel. Measuring a region is then a matter of rasterising the
+polygon and summing over the mask, fast enough to update the result while
+a vertex is dragged.
+"""
+
+import cv2
+import numpy
+
+from .measurements import metric_points
+
+
+class Polygon:
+    """Vertices of a polygon edited with the mouse, in depth map coordinates"""
+
+    def __init__(self):
+        self.vertices = []
+        self.dragged = None
+
+    def press(self, x, y, radius=6):
+        """Grab the vertex near (x, y) or add a new one"""
+        for index, (vx, vy) in enumerate(self.vertices):
+            if abs(vx - x) <= radius and abs(vy - y) <= radius:
+                self.dragged = index
+                return
+
+        self.vertices.append((x, y))
+        self.dragged = len(self.vertices) - 1
+
+    def move(self, x, y):
+        """Move the grabbed vertex, returns True if anything changed"""
+        if self.dragged is None:
+            return False
+        self.vertices[self.dragged] = (x, y)
+        return True
+
+    def release(self):
+        self.dragged = None
+
+    def clear(self):
+        self.vertices = []
+        self.dragged = None
+
+    def is_closed(self):
+        return len(self.vertices) >= 3
+
+
+def polygon_mask(vertices, shape):
+    """Pixels inside the polygon, as a boolean array of `shape` -- (height,
+    width) of the depth map"""
+    mask = numpy.zeros(shape, dtype=numpy.uint8)
+    points = numpy.round(numpy.array(vertices, dtype=numpy.float64)).astype(numpy.int32)
+    cv2.fillPoly(mask, [points], 1)
+    return mask.astype(bool)
+
+
+def triangle_areas(p0, p1, p2):
+    """Areas of triangles given as arrays of 3D points, shape (..., 3)"""
+    return 0.5 * numpy.linalg.norm(numpy.cross(p1 - p0, p2 - p0), axis=-1)
+
+
+class RegionResult:
+    def __init__(self, pixels, surface_area_cm2, volume_cm3):
+        self.pixels = pixels
+        self.surface_area_cm2 = surface_area_cm2
+        self.volume_cm3 = volume_cm3
+
+
+class RegionEngine:
+    """Measurements of regions of a single portrait.
+
+    :param depth_cm: metric depth grid, see `measurements.metric_depth_grid`
+    :param coords: `coordinates.CoordinateSystem` of the portrait
+    :param calibration: `calibration.CalibrationModel` of the device
+    """
+
+    def __init__(self, depth_cm, coords, calibration=None):
+        # Metric position of every pixel, in milimeters
+        self.points = metric_points(
+            depth_cm, coords, z_scale=10.0, calibration=calibration
+        )
+        self.z_mm = self.points[..., 2]
+
+        # Area of the part of the plane perpendicular to the camera axis
+        # that a pixel covers at its distance, mm^2
+        footprint_x, footprint_y = coords.pixel_footprint_mm(depth_cm, calibration)
+        self.footprint = footprint_x * footprint_y
+
+        # Surface area of every quad of 4 neighbouring pixels, split into
+        # 2 triangles, mm^2
+        p00 = self.points[:-1, :-1]
+        p01 = self.points[:-1, 1:]
+        p10 = self.points[1:, :-1]
+        p11 = self.points[1:, 1:]
+        self.quad_areas = triangle_areas(p00, p01, p10) + triangle_areas(p11, p10, p01)
+
+    def reference_plane(self, vertices):
+        """Least-squares plane z = a * x + b * y + c (x, y in pixels,
+        z in mm) through the vertices of the polygon"""
+        xs = numpy.array([int(round(x)) for x, _ in vertices])
+        ys = numpy.array([int(round(y)) for _, y in vertices])
+        xs = numpy.clip(xs, 0, self.z_mm.shape[1] - 1)
+        ys = numpy.clip(ys, 0, self.z_mm.shape[0] - 1)
+        zs = self.z_mm[ys, xs]
+
+        a = numpy.column_stack([xs, ys, numpy.ones(len(xs))])
+        coefficients, *_ = numpy.linalg.lstsq(a, zs, rcond=None)
+        return coefficients
+
+    def measure(self, vertices):
+        """Surface area and volume of the region.
+
+        Volume is measured between the surface and the reference plane going
+        through the vertices of the polygon; parts of the surface closer to
+        the camera than the plane count as positive.
+        """
+        mask = polygon_mask(vertices, self.z_mm.shape)
+        pixels = int(mask.sum())
+        if pixels == 0:
+            return RegionResult(0, 0.0, 0.0)
+
+        quads = mask[:-1, :-1] & mask[:-1, 1:] & mask[1:, :-1] & mask[1:, 1:]
+        surface_area = self.quad_areas[quads].sum()
+
+        a, b, c = self.reference_plane(vertices)
+        ys, xs = numpy.nonzero(mask)
+        heights = (a * xs + b * ys + c) - self.z_mm[ys, xs]
+        volume = (heights * self.footprint[ys, xs]).sum()
+
+        return RegionResult(pixels, surface_area / 100.0, volume / 1000.0)
@@ -0,0 +1,214 @@
+"""Measurements shown in the main window, computed off the GUI thread.
+
+`MainWindow.redrawImage` used to sample profiles, convert distances and build
+the report text in between `QPainter` calls. Now it takes a `Snapshot` of
+everything the report depends on and hands it to `ReportWorker`. The GUI
+thread paints the photo right away and paints the chart and the text when
+the `Report` comes back.
+
+Every snapshot carries a generation number. Reports of generations that were
+superseded in the meantime are not painted, but the click measurements they
+carry are still kept, as they are results of real clicks.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import dedent
+
+from PySide6.QtCore import QObject, Signal
+
+from . import measurements, profiles
+
+Snapshot = namedtuple(
+    "Snapshot",
+    [
+        # Increased by the main window for every new snapshot and for every
+        # loaded portrait, respectively:
+        "generation",
+        "load_generation",
+        # Read-only arrays of the portrait:
+        "depth_raw",
+        "depth_cm",
+        "float_range",
+        # `coordinates.CoordinateSystem` of the portrait
+        "coords",
+        "calibration",
+        "density",
+        "interpolation",
+        # (x1, y1, x2, y2) of the midline, top to bottom
+        "midline",
+        # (x, y) of the click and of the previous one (or None)
+        "click",
+        "previous_click",
+        # Raw depth at the previous click, or None
+        "previous_depth",
+        # True if both clicks were made by the user, so the pair is recorded
+        "record_pair",
+        # Decoded `IOSPortrait`, for the incisor distance, or None
+        "portrait",
+    ],
+)
+
+
+class Report:
+    def __init__(self, generation, load_generation, coords=None):
+        self.generation = generation
+        self.load_generation = load_generation
+        # Coordinate system the measurements were taken with
+        self.coords = coords
+        # (y coordinates, values) of the midline profile
+        self.chart_profile = None
+        # (z1, y1, z2, y2) of the line between clicks, drawn over the chart
+        self.chart_click_line = None
+        # Values along the line between clicks, for the zoom window
+        self.reconstruction = None
+        self.text = ""
+        # Click measurement to keep, like those of `measurements.point_pair`
+        self.record = None
+
+
+def compute_report(snapshot, display=True):
+    """Compute the report for a snapshot; with `display=False`, skip the parts
+    which are only painted.
+
+    Numbers come from the same `measurements` functions the exporter and
+    the service use.
+    """
+    report = Report(snapshot.generation, snapshot.load_generation, snapshot.coords)
+    raw, depth_cm, coords = snapshot.depth_raw, snapshot.depth_cm, snapshot.coords
+    mouse_x, mouse_y = snapshot.click
+    previous = snapshot.previous_click
+
+    if display:
+        _, ys, values = profiles.line_profile(
+            raw, *snapshot.midline, snapshot.density, snapshot.interpolation
+        )
+        report.chart_profile = (ys, values)
+
+        if previous is not None:
+            report.chart_click_line = (
+                int(raw[mouse_y, mouse_x]),
+                mouse_y,
+                int(raw[previous[1], previous[0]]),
+                previous[1],
+            )
+            report.reconstruction = profiles.line_profile(
+                raw,
+                mouse_x,
+                mouse_y,
+                *previous,
+                snapshot.density,
+                snapshot.interpolation,
+            )[2]
+
+    pair = None
+    if previous is not None and previous != (mouse_x, mouse_y):
+        pair = measurements.point_pair(
+            raw,
+            depth_cm,
+            coords,
+            *previous,
+            mouse_x,
+            mouse_y,
+            snapshot.calibration,
+            snapshot.density,
+            snapshot.interpolation,
+        )
+
+    closeness = int(raw[mouse_y, mouse_x])
+    depth_mm = float(depth_cm[mouse_y, mouse_x])
+
+    closeness_delta = 0
+    closeness_delta_mm = 0.0
+    if snapshot.previous_depth:
+        closeness_delta = snapshot.previous_depth - closeness
+        closeness_delta_mm = (
+            measurements.raw_to_cm(snapshot.previous_depth, *snapshot.float_range)
+            - depth_mm
+        )
+
+    txt = dedent(
+        f"""
+    Depth map coords:
+    {mouse_x, mouse_y}
+
+    Depth map raw data:
+    {closeness} (Δ: {closeness_delta})
+
+    Depth map distance:
+    {depth_mm:.2f} cm (Δ: {closeness_delta_mm:.1f} cm)
+
+    Line length (2D, on flat picture):
+    {pair["line_length_px"] if pair else 0:.2f} pixels
+
+    Vector length (3D) simple - on raw data:
+    {pair["vector_length_voxels"] if pair else 0:.2f} voxels
+
+    Vector length (3D) with depth:
+    {pair["vector_length_3d_cm"] if pair else 0:.2f} cm
+
+    Vector length (3D) on surface:
+    {pair["surface_length_cm"] if pair else 0:.2f} cm"""
+    )
+
+    if pair and not pair["calibrated"]:
+        txt += (
+            "\n\nDistance outside of the calibrated range "
+            f"({snapshot.calibration.min_distance:.0f}-"
+            f"{snapshot.calibration.max_distance:.0f} cm), "
+            "pixel/mm scale was clamped."
+        )
+
+    incisor = measurements.incisor_distance(
+        snapshot.portrait, depth_cm, coords, snapshot.calibration
+    )
+    if incisor is not None:
+        txt += "\n\nAutomatic incisor distance:\n"
+        txt += "%.2f cm" % incisor[4]
+
+    if pair and pair["angle_deg"] is not None:
+        txt += "\n\nAngle for last 2 clicks:\n%.2f°" % pair["angle_deg"]
+
+    report.text = txt.strip()
+
+    if snapshot.record_pair and pair and pair["vector_length_3d_cm"] > 0.0:
+        report.record = pair
+
+    return report
+
+
+class ReportWorker(QObject):
+    """Computes reports in a background thread, in the order of submission.
+
+    NumPy releases the GIL in the heavier array operations, so they run
+    while the GUI thread paints.
+    """
+
+    # Report
+    finished = Signal(object)
+    # Snapshot, exception
+    failed = Signal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # A single thread keeps the reports, and the clicks they record, in order:
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latest_generation = None
+
+    def submit(self, snapshot):
+        self.latest_generation = snapshot.generation
+        self.executor.submit(self._run, snapshot)
+
+    def _run(self, snapshot):
+        try:
+            # Skip painting-only work if a newer snapshot is already waiting:
+            report = compute_report(
+                snapshot, display=snapshot.generation == self.latest_generation
+            )
+        except Exception as e:
+            self.failed.emit(snapshot, e)
+        else:
+            self.finished.emit(report)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,391 @@
+"""Local HTTP/JSON measurement service.
+
+Lets other tools take FIDMAA measurements without the GUI. Requests are
+accepted by an asyncio server and computed in worker processes. Each worker
+keeps recently decoded portraits in a bounded LRU cache, and every portrait is
+always sent to the same worker, so repeated queries on a file skip decoding.
+
+Endpoints:
+
+``GET /health``
+    ``{"status": "ok"}``
+
+``POST /portraits``
+    body: HEIC file; returns ``{"id": ...}`` usable instead of a path
+
+``POST /measure``
+    body: ``{"path": ... | "id": ..., "midline": [x, y, angle],
+    "points": [[x1, y1, x2, y2], ...]}``; returns face parameters, incisor
+    distance, midline profile and measurements for every pair of points.
+    Coordinates are in the depth map space (480x640), like in the main window;
+    coordinates outside of the depth map are rejected with 400 Bad Request.
+
+Run with `fidmaa_serve [--host 127.0.0.1] [--port 8765]`.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+from portrait_analyser.exceptions import (
+    ExifValidationFailed,
+    MultipleFacesDetected,
+    NoDepthMapFound,
+    NoFacesDetected,
+    UnknownExtension,
+)
+from portrait_analyser.ios import load_image
+
+from . import calibration, measurements, profiles
+from .coordinates import CoordinateSystem
+from .face_detection import detect_face
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+MAX_UPLOAD_SIZE = 64 * 1024 * 1024
+
+#
+# Worker process side
+#
+
+_portraits = OrderedDict()
+_max_portraits = 8
+_calibrations = {}
+
+
+class LoadedPortrait:
+    def __init__(self, portrait, calibration=None):
+        self.portrait = portrait
+        self.calibration = calibration
+        self.depth_raw = measurements.depthmap_to_array(portrait.depthmap)
+        self.depth_cm = measurements.metric_depth_grid(
+            portrait.depthmap, portrait.floatValueMin, portrait.floatValueMax
+        )
+        self.coords = CoordinateSystem.for_portrait(portrait, self.depth_cm)
+        try:
+            self.face = detect_face(portrait.photo)
+        except (NoFacesDetected, MultipleFacesDetected) as e:
+            self.face = None
+            self.face_error = e.__class__.__name__
+        else:
+            self.face_error = None
+
+
+def _init_worker(max_portraits):
+    global _max_portraits, _calibrations
+    _max_portraits = max_portraits
+    _calibrations = calibration.load_calibrations()
+
+
+def _get_portrait(path):
+    key = (path, os.stat(path).st_mtime_ns)
+    if key in _portraits:
+        _portraits.move_to_end(key)
+        return _portraits[key]
+
+    ret = LoadedPortrait(
+        load_image(path),
+        calibration.for_device(calibration.device_model_of_file(path), _calibrations),
+    )
+    _portraits[key] = ret
+    while len(_portraits) > _max_portraits:
+        _portraits.popitem(last=False)
+    return ret
+
+
+def _face_to_json(face, coords):
+    if face is None:
+        return None
+
+    percent_width, percent_height = face.calculate_percentage_of_image()
+    return {
+        "x": int(face.x),
+        "y": int(face.y),
+        "width": int(face.width),
+        "height": int(face.height),
+        "percent_width": percent_width,
+        "percent_height": percent_height,
+        "rect": [float(value) for value in coords.rect_to_depth(face)],
+        "eyes": [
+            [float(value) for value in coords.rect_to_depth(eye)] for eye in face.eyes
+        ],
+    }
+
+
+class InvalidInput(ValueError):
+    """Coordinates in a request which do not fit the portrait"""
+
+
+def _numbers(value, count, what):
+    if (
+        not isinstance(value, (list, tuple))
+        or len(value) != count
+        or not all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in value
+        )
+    ):
+        raise InvalidInput(f"{what}: expected a list of {count} numbers, got {value!r}")
+    if not all(math.isfinite(v) for v in value):
+        raise InvalidInput(f"{what}: expected finite numbers, got {value!r}")
+    return value
+
+
+def _check_point(coords, x, y, what):
+    width, height = coords.depth_size
+    if not (0 <= x < width and 0 <= y < height):
+        raise InvalidInput(
+            f"{what}: point ({x}, {y}) outside of the depth map ({width}x{height})"
+        )
+
+
+def measure(path, midline=None, points=()):
+    """Runs in a worker process. Raises `InvalidInput` for coordinates
+    outside of the depth map."""
+    loaded = _get_portrait(path)
+    portrait = loaded.portrait
+
+    if midline is not None:
+        _numbers(midline, 3, "midline")
+        _check_point(loaded.coords, *midline[:2], "midline")
+    if not isinstance(points, (list, tuple)):
+        raise InvalidInput(f"points: expected a list, got {points!r}")
+    for index, point in enumerate(points):
+        x1, y1, x2, y2 = _numbers(point, 4, f"points[{index}]")
+        _check_point(loaded.coords, x1, y1, f"points[{index}]")
+        _check_point(loaded.coords, x2, y2, f"points[{index}]")
+
+    ret = {
+        "face": _face_to_json(loaded.face, loaded.coords),
+        "face_error": loaded.face_error,
+        "incisor_distance": None,
+        "midline": None,
+        "measurements": [],
+    }
+
+    incisor = measurements.incisor_distance(
+        portrait, loaded.depth_cm, loaded.coords, loaded.calibration
+    )
+    if incisor is not None:
+        ret["incisor_distance"] = dict(
+            zip(("x1", "y1", "x2", "y2", "distance_cm"), map(float, incisor))
+        )
+
+    if midline is None and loaded.face is not None:
+        midline = measurements.face_midline_point(loaded.face, loaded.coords) + (90,)
+
+    if midline is not None:
+        xs, ys = measurements.midline_samples(
+            *midline, depth_size=loaded.coords.depth_size
+        )
+        ret["midline"] = {
+            "x": xs.tolist(),
+            "y": ys.tolist(),
+            "raw": profiles.sample(loaded.depth_raw, xs, ys).tolist(),
+            "depth_cm": profiles.sample(loaded.depth_cm, xs, ys).tolist(),
+        }
+
+    for x1, y1, x2, y2 in points:
+        ret["measurements"].append(
+            measurements.point_pair(
+                loaded.depth_raw,
+                loaded.depth_cm,
+                loaded.coords,
+                int(x1),
+                int(y1),
+                int(x2),
+                int(y2),
+                loaded.calibration,
+            )
+        )
+
+    return ret
+
+
+#
+# asyncio front end
+#
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MeasurementService:
+    def __init__(self, upload_directory=None, workers=None, max_portraits=8):
+        if upload_directory is None:
+            upload_directory = os.path.join(tempfile.gettempdir(), "fidmaa-uploads")
+        os.makedirs(upload_directory, exist_ok=True)
+        self.upload_directory = upload_directory
+
+        # One single-process executor per worker, so that a portrait always
+        # goes to the worker which has it in its cache:
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1, initializer=_init_worker, initargs=(max_portraits,)
+            )
+            for _ in range(workers or os.cpu_count() or 1)
+        ]
+
+    def executor_for(self, path):
+        return self.executors[zlib.crc32(path.encode("utf-8")) % len(self.executors)]
+
+    def upload_path(self, upload_id):
+        if not upload_id.isalnum():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid id")
+        return os.path.join(self.upload_directory, upload_id + ".heic")
+
+    def save_upload(self, body):
+        upload_id = hashlib.sha1(body).hexdigest()
+        path = self.upload_path(upload_id)
+        if not os.path.exists(path):
+            with open(path + ".tmp", "wb") as f:
+                f.write(body)
+            os.replace(path + ".tmp", path)
+        return {"id": upload_id}
+
+    async def measure(self, body):
+        try:
+            request = json.loads(body)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid JSON")
+
+        if not isinstance(request, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "JSON object expected")
+
+        if "id" in request:
+            path = self.upload_path(str(request["id"]))
+        elif "path" in request:
+            path = os.path.abspath(os.path.expanduser(str(request["path"])))
+        else:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Pass either path or id")
+
+        if not os.path.exists(path):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "No such file")
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self.executor_for(path),
+                measure,
+                path,
+                request.get("midline"),
+                request.get("points", []),
+            )
+        except ExifValidationFailed as e:
+            raise HTTPError(
+                HTTPStatus.UNPROCESSABLE_ENTITY, f"Not a TrueDepth camera image ({e})"
+            )
+        except NoDepthMapFound:
+            raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, "No depth data")
+        except UnknownExtension as e:
+            raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+        except InvalidInput as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+    async def dispatch(self, method, path, body):
+        if (method, path) == ("GET", "/health"):
+            return {"status": "ok"}
+        if (method, path) == ("POST", "/portraits"):
+            return self.save_upload(body)
+        if (method, path) == ("POST", "/measure"):
+            return await self.measure(body)
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Not found")
+
+    async def read_request(self, reader):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Bad request")
+
+        if length > MAX_UPLOAD_SIZE:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Too large")
+
+        body = await reader.readexactly(length)
+        return method, urlsplit(target).path, body
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await self.read_request(reader)
+            status = HTTPStatus.OK
+            payload = await self.dispatch(method, path, body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception as e:
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            payload = {"error": f"{e.__class__.__name__}: {e}"}
+
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(
+            (
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"FIDMAA measurement service listening on http://{host}:{port}/")
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FIDMAA measurement service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=8,
+        help="how many decoded portraits each worker keeps in memory",
+    )
+    parser.add_argument("--upload-directory", default=None)
+    args = parser.parse_args()
+
+    service = MeasurementService(
+        upload_directory=args.upload_directory,
+        workers=args.workers,
+        max_portraits=args.cache_size,
+    )
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
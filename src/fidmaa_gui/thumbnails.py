@@ -0,0 +1,293 @@
+"""Thumbnails of portraits for the directory browser.
+
+Thumbnails embedded in the HEIC files (the full photo, only for files without
+one) are decoded in a worker pool and cached on disk as PNG files, together
+with the result of the metadata check from `triage`. The model only asks for the
+thumbnails of the rows the view actually paints, so directories with thousands
+of files stay cheap.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import pyheif
+from _libheif_cffi import ffi
+from _libheif_cffi import lib as libheif
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+from pyheif.error import _assert_success
+from pyheif.reader import _keep_refs, _read_heif_handle
+from PySide6.QtCore import (
+    QAbstractListModel,
+    QModelIndex,
+    QObject,
+    QRunnable,
+    QStandardPaths,
+    Qt,
+    QThreadPool,
+    Signal,
+)
+from PySide6.QtGui import QColor, QPainter, QPixmap
+
+from . import triage
+
+THUMBNAIL_SIZE = (120, 160)
+
+# How many thumbnails are kept in memory; the rest is read back from disk cache:
+MAX_PIXMAPS = 500
+
+# Jobs queued or being decoded. Each one is referenced here until it finishes
+# or is cancelled, so closing a model never has to wait for its jobs:
+_running_jobs = set()
+
+CATEGORY_KEY = "fidmaa-category"
+
+BADGE_COLORS = {
+    triage.USABLE: QColor(0, 200, 0),
+    triage.WRONG_CAMERA: QColor(220, 0, 0),
+    triage.NO_DEPTH: QColor(220, 0, 0),
+    triage.STRIPPED: QColor(255, 140, 0),
+    triage.UNREADABLE: QColor(128, 128, 128),
+}
+
+
+def thumbnail_cache_directory():
+    ret = os.path.join(
+        QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "thumbnails"
+    )
+    os.makedirs(ret, exist_ok=True)
+    return ret
+
+
+def thumbnail_cache_path(filename, cache_directory):
+    """Cache file name changes whenever the portrait is modified"""
+    st = os.stat(filename)
+    key = f"{os.path.abspath(filename)}:{st.st_mtime_ns}:{st.st_size}:{THUMBNAIL_SIZE}"
+    return os.path.join(
+        cache_directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png"
+    )
+
+
+def heif_to_pil(heif_image):
+    """PIL image of a decoded pyheif image, honouring its row stride"""
+    return Image.frombytes(
+        heif_image.mode,
+        heif_image.size,
+        heif_image.data,
+        "raw",
+        heif_image.mode,
+        heif_image.stride,
+    )
+
+
+def embedded_thumbnails(primary_image):
+    """Undecoded thumbnails stored in the container for the primary image.
+
+    pyheif does not wrap them, so they are read through its libheif bindings,
+    the same way it reads the depth image."""
+    image = primary_image.image
+    handle = getattr(image, "_heif_handle", None)
+    if handle is None:
+        # Already decoded, the handle is released
+        return []
+
+    count = libheif.heif_image_handle_get_number_of_thumbnails(handle)
+    if count == 0:
+        return []
+    ids = ffi.new("heif_item_id[]", count)
+    count = libheif.heif_image_handle_get_list_of_thumbnail_IDs(handle, ids, count)
+
+    ret = []
+    for thumbnail_id in ids[0:count]:
+        p_handle = ffi.new("struct heif_image_handle **")
+        error = libheif.heif_image_handle_get_thumbnail(handle, thumbnail_id, p_handle)
+        _assert_success(error)
+        collect = _keep_refs(libheif.heif_image_handle_release, handle=handle)
+        ret.append(
+            _read_heif_handle(
+                ffi.gc(p_handle[0], collect),
+                image.apply_transformations,
+                image.convert_hdr_to_8bit,
+            )
+        )
+    return ret
+
+
+def embedded_thumbnail(primary_image, size=THUMBNAIL_SIZE):
+    """The smallest thumbnail stored in the container that is at least `size`,
+    or the biggest one; None if there are none."""
+    thumbnails = sorted(
+        embedded_thumbnails(primary_image),
+        key=lambda thumbnail: thumbnail.size[0] * thumbnail.size[1],
+    )
+    for thumbnail in thumbnails:
+        if thumbnail.size[0] >= size[0] or thumbnail.size[1] >= size[1]:
+            return thumbnail
+    if thumbnails:
+        return thumbnails[-1]
+
+
+def decode_thumbnail(filename, size=THUMBNAIL_SIZE):
+    """Decode the thumbnail embedded in the file; the full-resolution photo
+    is decoded only if there is none"""
+    with open(filename, "rb") as f:
+        heif_container = pyheif.open_container(f)
+
+    primary_image = heif_container.primary_image
+    undecoded = embedded_thumbnail(primary_image, size) or primary_image.image
+
+    image = heif_to_pil(undecoded.load())
+    image.thumbnail(size)
+    return image
+
+
+class ThumbnailJobSignals(QObject):
+    # filename, path of the cached thumbnail, triage category
+    finished = Signal(str, str, str)
+
+
+class ThumbnailJob(QRunnable):
+    def __init__(self, filename, cache_directory):
+        super().__init__()
+        self.filename = filename
+        self.cache_directory = cache_directory
+        self.signals = ThumbnailJobSignals()
+        # The model keeps a reference to pending jobs:
+        self.setAutoDelete(False)
+
+    def run(self):
+        try:
+            path = thumbnail_cache_path(self.filename, self.cache_directory)
+            if os.path.exists(path):
+                with Image.open(path) as image:
+                    category = image.text.get(CATEGORY_KEY, triage.UNREADABLE)
+            else:
+                category = triage.scan_file(self.filename).category
+                image = decode_thumbnail(self.filename)
+
+                info = PngInfo()
+                info.add_text(CATEGORY_KEY, category)
+                image.save(path + ".tmp", "PNG", pnginfo=info)
+                os.replace(path + ".tmp", path)
+        except Exception:
+            self.signals.finished.emit(self.filename, "", triage.UNREADABLE)
+            return
+
+        self.signals.finished.emit(self.filename, path, category)
+
+
+def thumbnail_with_badge(path, category):
+    pixmap = QPixmap(*THUMBNAIL_SIZE)
+    pixmap.fill(Qt.lightGray)
+
+    painter = QPainter(pixmap)
+    if path:
+        thumbnail = QPixmap(path)
+        painter.drawPixmap(
+            (pixmap.width() - thumbnail.width()) // 2,
+            (pixmap.height() - thumbnail.height()) // 2,
+            thumbnail,
+        )
+
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(QColor(255, 255, 255))
+    painter.setBrush(BADGE_COLORS[category])
+    painter.drawEllipse(pixmap.width() - 22, 6, 16, 16)
+    painter.end()
+    return pixmap
+
+
+def _job_done(job):
+    _running_jobs.discard(job)
+
+
+class ThumbnailModel(QAbstractListModel):
+    """Thumbnails of `filenames`, decoded in `pool` -- shared by the models
+    of a browser, so changing directories does not create new threads"""
+
+    def __init__(self, filenames, parent=None, max_workers=None, pool=None):
+        super().__init__(parent)
+        self.filenames = list(filenames)
+        self.rows = {filename: row for row, filename in enumerate(self.filenames)}
+
+        self.pixmaps = OrderedDict()
+        self.categories = {}
+        self.pending = {}
+
+        self.cache_directory = thumbnail_cache_directory()
+        self.pool = pool if pool is not None else QThreadPool(self)
+        if max_workers is not None:
+            self.pool.setMaxThreadCount(max_workers)
+
+        self.placeholder = QPixmap(*THUMBNAIL_SIZE)
+        self.placeholder.fill(Qt.lightGray)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.filenames)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return
+
+        filename = self.filenames[index.row()]
+
+        if role == Qt.DisplayRole:
+            return os.path.basename(filename)
+
+        if role == Qt.DecorationRole:
+            return self.thumbnail(filename)
+
+        if role == Qt.ToolTipRole:
+            category = self.categories.get(filename)
+            if category is None:
+                return filename
+            return f"{filename}\n{category}"
+
+        if role == Qt.UserRole:
+            return filename
+
+    def thumbnail(self, filename):
+        if filename in self.pixmaps:
+            self.pixmaps.move_to_end(filename)
+            return self.pixmaps[filename]
+
+        if filename not in self.pending:
+            job = ThumbnailJob(filename, self.cache_directory)
+            job.signals.finished.connect(self.thumbnailReady)
+            job.signals.finished.connect(lambda *args, job=job: _job_done(job))
+            self.pending[filename] = job
+            _running_jobs.add(job)
+            self.pool.start(job)
+
+        return self.placeholder
+
+    def thumbnailReady(self, filename, path, category):
+        if self.pending.pop(filename, None) is None:
+            # Started before this model was shut down
+            return
+        self.categories[filename] = category
+
+        self.pixmaps[filename] = thumbnail_with_badge(path, category)
+        while len(self.pixmaps) > MAX_PIXMAPS:
+            self.pixmaps.popitem(last=False)
+
+        index = self.index(self.rows[filename])
+        self.dataChanged.emit(index, index)
+
+    def cancelOutside(self, first, last):
+        """Cancel jobs not started yet for rows outside of [first, last]"""
+        for filename, job in list(self.pending.items()):
+            if not first <= self.rows[filename] <= last and self.pool.tryTake(job):
+                del self.pending[filename]
+                _job_done(job)
+
+    def shutdown(self):
+        """Cancel queued jobs without waiting for the running ones; those
+        finish on their own and are not reported to this model any more"""
+        for job in self.pending.values():
+            if self.pool.tryTake(job):
+                _job_done(job)
+        self.pending = {}
@@ -0,0 +1,127 @@
+"""Sort a directory tree of portraits into usable and unusable ones.
+
+Only the container is parsed -- HEIC boxes, EXIF and the list of auxiliary
+images -- no pixels are decoded, so a whole directory of uploads can be
+checked in seconds instead of opening each file in the GUI.
+
+Run as `fidmaa_triage DIRECTORY [--report report.csv]`.
+"""
+
+import argparse
+import csv
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import piexif
+import pyheif
+
+from . import const
+from .export import find_portraits
+
+USABLE = "usable"
+WRONG_CAMERA = "wrong camera"
+NO_DEPTH = "no depth"
+STRIPPED = "stripped by Messages"
+UNREADABLE = "unreadable"
+
+CATEGORIES = [USABLE, WRONG_CAMERA, NO_DEPTH, STRIPPED, UNREADABLE]
+
+
+class TriageResult:
+    def __init__(self, filename, category, lens_model=None, reason=""):
+        self.filename = filename
+        self.category = category
+        self.lens_model = lens_model
+        self.reason = reason
+
+    def __str__(self):
+        ret = f"{self.filename}: {self.category}"
+        if self.reason:
+            ret += f" ({self.reason})"
+        return ret
+
+
+def lens_model(exif):
+    value = exif.get("Exif", {}).get(piexif.ExifIFD.LensModel)
+    if isinstance(value, bytes):
+        value = value.decode("ascii", errors="replace").rstrip("\x00")
+    return value
+
+
+def scan_file(filename):
+    """Classify a single file using its container metadata only"""
+    try:
+        with open(filename, "rb") as f:
+            heif_container = pyheif.open_container(f)
+        primary_image = heif_container.primary_image
+
+        exif = None
+        for metadata in primary_image.image.metadata or []:
+            if metadata.get("type", "") == "Exif":
+                exif = piexif.load(metadata["data"])
+    except Exception as e:
+        return TriageResult(filename, UNREADABLE, reason=str(e))
+
+    has_depth = primary_image.depth_image is not None
+    model = lens_model(exif) if exif is not None else None
+
+    if model is None:
+        # Files sent via Messages lose their camera description (and usually
+        # the depth data as well)
+        return TriageResult(
+            filename,
+            STRIPPED,
+            reason="no camera description" + ("" if has_depth else ", no depth data"),
+        )
+
+    if const.TRUEDEPTH_EXIF_ID not in model:
+        return TriageResult(filename, WRONG_CAMERA, model)
+
+    if not has_depth:
+        return TriageResult(filename, NO_DEPTH, model)
+
+    return TriageResult(filename, USABLE, model)
+
+
+def scan_directory(directory, workers=None):
+    """Classify all portraits in a directory tree in parallel.
+
+    Parsing happens in libheif, which releases the GIL, so threads are enough.
+    Results are yielded in the order of files.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(scan_file, find_portraits(directory))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check which portraits can be used for FIDMAA measurements"
+    )
+    parser.add_argument("directory", help="directory with HEIC files")
+    parser.add_argument("--report", help="write a CSV report to this file")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    report = None
+    if args.report:
+        report_file = open(args.report, "w", newline="", encoding="utf-8")
+        report = csv.writer(report_file)
+        report.writerow(["file", "category", "lens_model", "reason"])
+
+    counter = Counter()
+    try:
+        for result in scan_directory(args.directory, args.workers):
+            counter[result.category] += 1
+            print(result)
+            if report is not None:
+                report.writerow(
+                    [result.filename, result.category, result.lens_model, result.reason]
+                )
+    finally:
+        if report is not None:
+            report_file.close()
+
+    print(file=sys.stderr)
+    for category in CATEGORIES:
+        print(f"{category}: {counter[category]}", file=sys.stderr)